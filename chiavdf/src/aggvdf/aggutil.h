@@ -284,6 +284,129 @@ form PowFormWithQuotient(form g,
 	return x;
 }
 
+// Reduces f only once 'a' exceeds half of the discriminant size,
+// as FastPowFormNucomp does between squarings.
+inline void ReduceIfLarge(form &f, int max_size, PulmarkReducer &reducer) {
+	if (f.a.impl->_mp_size > max_size) {
+		reducer.reduce(f);
+	}
+}
+
+inline int ExpDigit(integer &exp, int offset, int width) {
+	int digit = 0;
+	for (int b = width - 1; b >= 0; b--) {
+		digit = (digit << 1) | (exp.get_bit(offset + b) ? 1 : 0);
+	}
+	return digit;
+}
+
+// Pippenger's bucket method, used by MultiPowFormNucomp for many bases.
+form MultiPowFormPippenger(std::vector<form> &bases,
+                           std::vector<integer> &exps,
+                           int max_bits,
+                           integer &D,
+                           integer &L,
+                           PulmarkReducer &reducer) {
+	int n = bases.size();
+	int max_size = -D.impl->_mp_size / 2;
+	int c = 2;
+	while ((2 << (c + 2)) <= n && c < 16) c++;
+	int windows = (max_bits + c - 1) / c;
+
+	form res = form::identity(D);
+	std::vector<form> buckets(1 << c);
+	std::vector<bool> filled(1 << c);
+	for (int j = windows - 1; j >= 0; j--) {
+		for (int i = 0; i < c; i++) {
+			nudupl_form(res, res, D, L);
+			ReduceIfLarge(res, max_size, reducer);
+		}
+		std::fill(filled.begin(), filled.end(), false);
+		for (int i = 0; i < n; i++) {
+			int digit = ExpDigit(exps[i], j * c, c);
+			if (!digit) continue;
+			if (filled[digit]) {
+				nucomp_form(buckets[digit], buckets[digit], bases[i], D, L);
+				ReduceIfLarge(buckets[digit], max_size, reducer);
+			} else {
+				buckets[digit] = bases[i];
+				filled[digit] = true;
+			}
+		}
+		// sum_d d * bucket_d as a running product from the largest digit down
+		form running = form::identity(D);
+		form sum = form::identity(D);
+		for (int d = (1 << c) - 1; d >= 1; d--) {
+			if (filled[d]) {
+				nucomp_form(running, running, buckets[d], D, L);
+				ReduceIfLarge(running, max_size, reducer);
+			}
+			nucomp_form(sum, sum, running, D, L);
+			ReduceIfLarge(sum, max_size, reducer);
+		}
+		nucomp_form(res, res, sum, D, L);
+		ReduceIfLarge(res, max_size, reducer);
+	}
+	reducer.reduce(res);
+	return res;
+}
+
+/**
+ * MultiPowFormNucomp computes prod_i bases[i]^{exps[i]} sharing one chain of
+ * squarings between all the bases, instead of one FastPowFormNucomp per base.
+ * Few bases use Straus' interleaved fixed-window method, many bases switch
+ * to Pippenger's bucket method.
+ */
+form MultiPowFormNucomp(std::vector<form> &bases,
+                        std::vector<integer> &exps,
+                        integer &D,
+                        integer &L,
+                        PulmarkReducer &reducer) {
+	int n = bases.size();
+	int max_bits = 0;
+	for (int i = 0; i < n; i++) {
+		max_bits = std::max(max_bits, (int)exps[i].num_bits());
+	}
+	if (n == 0 || max_bits == 0) {
+		return form::identity(D);
+	}
+	if (n >= 32) {
+		return MultiPowFormPippenger(bases, exps, max_bits, D, L, reducer);
+	}
+
+	int max_size = -D.impl->_mp_size / 2;
+	const int w = 4;
+	int windows = (max_bits + w - 1) / w;
+	// table[i][d] = bases[i]^d
+	std::vector<std::vector<form>> table(n, std::vector<form>(1 << w));
+	for (int i = 0; i < n; i++) {
+		table[i][1] = bases[i];
+		for (int d = 2; d < (1 << w); d++) {
+			nucomp_form(table[i][d], table[i][d - 1], bases[i], D, L);
+			reducer.reduce(table[i][d]);
+		}
+	}
+
+	form res = form::identity(D);
+	for (int j = windows - 1; j >= 0; j--) {
+		if (j != windows - 1) {
+			for (int b = 0; b < w; b++) {
+				nudupl_form(res, res, D, L);
+				ReduceIfLarge(res, max_size, reducer);
+			}
+		}
+		for (int i = 0; i < n; i++) {
+			int digit = ExpDigit(exps[i], j * w, w);
+			if (digit) {
+				nucomp_form(res, res, table[i][digit], D, L);
+				ReduceIfLarge(res, max_size, reducer);
+			}
+		}
+	}
+	reducer.reduce(res);
+	return res;
+}
+
 // leehsun: We modify HashPrime to return the number of iterations to find the prime.
 // If skip_to_iteration != -1, then HashPrime will keep hashing to skip_to_iteration
 // and only test the prime number for once.
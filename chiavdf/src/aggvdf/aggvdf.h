@@ -2,6 +2,28 @@
 #include "../prover_slow.h"
 #include "aggutil.h"
 
+/**
+ * ParallelFor splits [0, n) into nthreads contiguous ranges the same way
+ * VerifyAggProof does and calls f(bi, ei, tt) for each range on its own thread.
+ * With a single thread f runs on the calling thread.
+*/
+template <typename F>
+void ParallelFor(int n, size_t nthreads, F f) {
+    if (nthreads < 1) nthreads = 1;
+    if (nthreads > (size_t)n) nthreads = std::max(n, 1);
+    if (nthreads == 1) {
+        f(0, n, 0);
+        return;
+    }
+    std::vector<std::thread> threads(nthreads);
+    for (int tt = 0; tt < nthreads; tt++) {
+        int bi = tt * n / nthreads;
+        int ei = (tt + 1) == nthreads ? n : (tt + 1) * n / nthreads;
+        threads[tt] = std::thread(f, bi, ei, tt);
+    }
+    std::for_each(threads.begin(), threads.end(), [](std::thread& x){x.join();});
+}
+
 /**
  * EvalAggVdf evalutes the VDF by computing y <- g^{2^t} and 
  * uses H_G (ClHash) to hash challenge into class group element g
@@ -28,6 +50,150 @@ std::tuple<form, int> EvalAggVdf(integer D, integer challenge_int, uint64_t t) {
     return tie(y, a_iter);
 }
 
+/**
+ * EvalAggVdfs evaluates independent challenges with EvalAggVdf,
+ * spreading them over nthreads threads.
+ * @param D The discriminant of the class group.
+ * @param challenge_integers Contains all challenge_integers of VDFs.
+ * @param t The number of squaring of group operations.
+ * @param nthreads Is the number of threads used to evaluate in parallel.
+ * @return results The y and a_iter of every challenge, in order.
+*/
+std::vector<std::tuple<form, int>> EvalAggVdfs(integer D,
+    std::vector<integer>& challenge_integers,
+    uint64_t t,
+    size_t nthreads) {
+    std::vector<std::tuple<form, int>> results(challenge_integers.size());
+    ParallelFor(challenge_integers.size(), nthreads,
+        [&](const int bi, const int ei, const int tt) {
+            for (int i = bi; i < ei; i++) {
+                results[i] = EvalAggVdf(D, challenge_integers[i], t);
+            }
+        });
+    return results;
+}
+
+/**
+ * AggVdfState caches what AggreateVdfProofs needs from a single VDF so that
+ * a VDF taking part in several aggregation windows is only hashed, serialized
+ * and evaluated once.
+ * intermediates[i] holds g^{2^{i*k*l}}, recorded during evaluation in the
+ * same layout ProveSlow uses, so the Wesolowski quotient for any prime B
+ * can be recovered from them in roughly t/k group operations.
+*/
+struct AggVdfState {
+    integer challenge;
+    int a_iter;
+    form g;
+    form y;
+    std::vector<uint8_t> g_bytes;
+    std::vector<uint8_t> y_bytes;
+    int k;
+    int l;
+    std::vector<form> intermediates;
+};
+
+/**
+ * EvalAggVdfWithCheckpoints evaluates the VDF like EvalAggVdf and keeps
+ * the checkpoints needed to prove it later from an AggVdfState.
+ * @param D The discriminant of the class group.
+ * @param challenge_int The challenge in integer form.
+ * @param t The number of squaring of group operations.
+ * @param checkpoint_interval The number of squarings between two checkpoints,
+ *        0 lets ApproximateParameters pick it as ProveSlow does.
+ * @return state The cached g, y, their serialization and the checkpoints.
+*/
+AggVdfState EvalAggVdfWithCheckpoints(integer D, integer challenge_int, uint64_t t,
+    uint64_t checkpoint_interval = 0) {
+    integer Lroot = root(-D, 4);
+    PulmarkReducer reducer;
+    int d_size = D.num_bits();
+    AggVdfState state;
+    state.challenge = challenge_int;
+    tie(state.g, state.a_iter) = H_G(challenge_int, D);
+
+    ApproximateParameters(t, state.l, state.k);
+    if (state.k <= 0) state.k = 1;
+    if (state.l <= 0) state.l = 1;
+    if (checkpoint_interval > 0) {
+        // the interval is k*l, keep the largest block size k that divides it
+        state.k = std::min<uint64_t>(state.k, checkpoint_interval);
+        while (checkpoint_interval % state.k != 0) state.k--;
+        state.l = checkpoint_interval / state.k;
+    }
+    uint64_t kl = state.k * state.l;
+    state.intermediates.reserve((t + kl - 1) / kl);
+
+    form y = state.g;
+    for (uint64_t i = 0; i < t; i++) {
+        if (i % kl == 0) {
+            state.intermediates.push_back(y);
+        }
+        nudupl_form(y, y, D, Lroot);
+        reducer.reduce(y);
+    }
+    state.y = y;
+    state.g_bytes = SerializeForm(state.g, d_size);
+    state.y_bytes = SerializeForm(state.y, d_size);
+    return state;
+}
+
+// alpha_j <- int(H(bin(j)||s))
+integer AggregationAlpha(int i, std::vector<uint8_t> &s) {
+    std::vector<uint8_t> seed = int2bytes(i);
+    seed.insert(seed.end(), s.begin(), s.end());
+    std::vector<uint8_t> hash(picosha2::k_digest_size);  // output of sha256
+    picosha2::hash256(seed.begin(), seed.end(), hash.begin(), hash.end());
+    return integer(hash);
+}
+
+/**
+ * TreeProduct multiplies parts pairwise, one level of the tree at a time,
+ * with every level spread over nthreads threads.
+*/
+form TreeProduct(std::vector<form> parts, integer &D, size_t nthreads) {
+    if (parts.empty()) {
+        return form::identity(D);
+    }
+    while (parts.size() > 1) {
+        int half = parts.size() / 2;
+        std::vector<form> next((parts.size() + 1) / 2);
+        ParallelFor(half, nthreads, [&](const int bi, const int ei, const int tt) {
+            for (int i = bi; i < ei; i++) {
+                next[i] = parts[2 * i] * parts[2 * i + 1];
+            }
+        });
+        if (parts.size() % 2 == 1) {
+            next.back() = parts.back();
+        }
+        parts = std::move(next);
+    }
+    return parts[0];
+}
+
+/**
+ * AggregateGenerators computes prod_i gs[i]^{alpha_i}, where alpha_i is derived
+ * from s, with the bases spread over nthreads threads. Every thread does a
+ * single multi-exponentiation over its range and the partial products are
+ * combined by TreeProduct.
+*/
+form AggregateGenerators(std::vector<form> &gs, std::vector<uint8_t> &s,
+    integer &D, integer &Lroot, size_t nthreads) {
+    std::vector<form> partials(std::max<size_t>(std::min<size_t>(nthreads, gs.size()), 1),
+        form::identity(D));
+    ParallelFor(gs.size(), nthreads, [&](const int bi, const int ei, const int tt) {
+        // PulmarkReducer cannot be used as a shared variable in threads
+        PulmarkReducer reducer;
+        std::vector<form> bases(gs.begin() + bi, gs.begin() + ei);
+        std::vector<integer> alphas;
+        for (int i = bi; i < ei; i++) {
+            alphas.push_back(AggregationAlpha(i, s));
+        }
+        partials[tt] = MultiPowFormNucomp(bases, alphas, D, Lroot, reducer);
+    });
+    return TreeProduct(partials, D, nthreads);
+}
+
 /**
  * AggreateVdfProofs generates aggregated VDF proof.
  * This technique can only be used on VDFs in the same group (same discriminant).
@@ -39,6 +205,7 @@ std::tuple<form, int> EvalAggVdf(integer D, integer challenge_int, uint64_t t) {
  * @param ys Contains all the result of VDFs.
  * @param num_iterations The number of squaring of group operations.
  * @param a_iters Contains all the number of iterations to generate a valid g of each VDF.
+ * @param nthreads Is the number of threads used to hash and aggregate in parallel.
  * @return proof Is the aggregated proof.
  * @return b_iter Is the number of iterations to generate Fiat-Shamir challenge.
 */
@@ -46,7 +213,8 @@ std::tuple<form, int> AggreateVdfProofs(integer D,
     std::vector<integer>& challenge_integers, 
     std::vector<form>& ys,
     uint64_t num_iterations, 
-    std::vector<int> a_iters)
+    std::vector<int> a_iters,
+    size_t nthreads = 1)
 {
     int d_size = D.num_bits();
     integer Lroot = root(-D, 4);
@@ -55,9 +223,11 @@ std::tuple<form, int> AggreateVdfProofs(integer D,
     std::vector<form> gs(proofs_num);
 
     // g_i <- H_{Cl(d)}(x_{root,j})
-    for (int i = 0; i < proofs_num; i++) {
-        gs[i] = H_GFast(challenge_integers[i], D, a_iters[i]);
-    }
+    ParallelFor(proofs_num, nthreads, [&](const int bi, const int ei, const int tt) {
+        for (int i = bi; i < ei; i++) {
+            gs[i] = H_GFast(challenge_integers[i], D, a_iters[i]);
+        }
+    });
 
     // s = bin(g_1)||...||bin(g_n)||bin(y_1)...||bin(y_n)
     std::vector<uint8_t> s;
@@ -74,24 +244,126 @@ std::tuple<form, int> AggreateVdfProofs(integer D,
     // B is the l here.
     // B is the Fiat-Shamir non-interactive challenge.
     tie(B, b_iter) = HashPrimeWithIteration(s, 264, {263});
-    form agg_g = form::identity(D);
+    form agg_g = AggregateGenerators(gs, s, D, Lroot, nthreads);
 
+    // g^{2^T/l} = g^{2^T/B}
+    form proof = PowFormWithQuotient(agg_g, D, num_iterations, B, Lroot, reducer);
+    return std::make_tuple(proof, b_iter);
+}
+
+/**
+ * AggreateVdfProofsFromStates generates the same aggregated proof as
+ * AggreateVdfProofs, reusing the g_i, serialized forms and checkpoints
+ * cached in states instead of recomputing them.
+ * Since (prod g_i^{alpha_i})^{floor(2^T/B)} = prod (g_i^{floor(2^T/B)})^{alpha_i},
+ * each quotient is recovered from its own checkpoints when that is cheaper
+ * than the T squarings PowFormWithQuotient performs on the aggregated g.
+ * @param D The discriminant of the class group.
+ * @param states Contains the cached state of every VDF, in window order.
+ * @param num_iterations The number of squaring of group operations.
+ * @param nthreads Is the number of threads used to aggregate in parallel.
+ * @return proof Is the aggregated proof.
+ * @return b_iter Is the number of iterations to generate Fiat-Shamir challenge.
+*/
+std::tuple<form, int> AggreateVdfProofsFromStates(integer D,
+    std::vector<AggVdfState*>& states,
+    uint64_t num_iterations,
+    size_t nthreads = 1)
+{
+    integer Lroot = root(-D, 4);
+    PulmarkReducer reducer;
+    int proofs_num = states.size();
+
+    // s = bin(g_1)||...||bin(g_n)||bin(y_1)...||bin(y_n)
+    std::vector<uint8_t> s;
     for (int i = 0; i < proofs_num; i++){
-        std::vector<uint8_t> seed = int2bytes(i);
-        seed.insert(seed.end(), s.begin(), s.end());
-        std::vector<uint8_t> hash(picosha2::k_digest_size);  // output of sha256
-        picosha2::hash256(seed.begin(), seed.end(), hash.begin(), hash.end());
-        // 2**(k_digest_size) = 2**32
-        // alpha_j <- int(H(bin(j)||s))
-        integer alpha(hash);
-        agg_g = agg_g * FastPowFormNucomp(gs[i], D, alpha, Lroot, reducer);
+        s.insert(s.end(), states[i]->g_bytes.begin(), states[i]->g_bytes.end());
+        s.insert(s.end(), states[i]->y_bytes.begin(), states[i]->y_bytes.end());
     }
 
-    // g^{2^T/l} = g^{2^T/B}
-    form proof = PowFormWithQuotient(agg_g, D, num_iterations, B, Lroot, reducer);
+    integer B;
+    int b_iter;
+    tie(B, b_iter) = HashPrimeWithIteration(s, 264, {263});
+
+    // Every checkpointed quotient costs about T/k compositions plus l*2^k
+    // for combining the buckets, against T squarings and T/2 compositions
+    // for a single PowFormWithQuotient.
+    uint64_t checkpoint_cost = 0;
+    bool has_checkpoints = true;
+    for (int i = 0; i < proofs_num; i++) {
+        AggVdfState *state = states[i];
+        if (state->intermediates.empty()) {
+            has_checkpoints = false;
+            break;
+        }
+        checkpoint_cost += num_iterations / state->k + ((uint64_t)state->l << (state->k + 1));
+    }
+    uint64_t quotient_cost = num_iterations + num_iterations / 2;
+
+    std::vector<form> bases(proofs_num);
+    form proof;
+    if (has_checkpoints && checkpoint_cost < quotient_cost) {
+        // the quotients are independent, so they are spread over the threads
+        ParallelFor(proofs_num, nthreads, [&](const int bi, const int ei, const int tt) {
+            PulmarkReducer reducer;
+            for (int i = bi; i < ei; i++) {
+                AggVdfState *state = states[i];
+                bases[i] = GenerateWesolowskiWithB(B, D, reducer,
+                    state->intermediates, num_iterations, state->k, state->l);
+            }
+        });
+        proof = AggregateGenerators(bases, s, D, Lroot, nthreads);
+    } else {
+        for (int i = 0; i < proofs_num; i++) {
+            bases[i] = states[i]->g;
+        }
+        form agg_g = AggregateGenerators(bases, s, D, Lroot, nthreads);
+        proof = PowFormWithQuotient(agg_g, D, num_iterations, B, Lroot, reducer);
+    }
     return std::make_tuple(proof, b_iter);
 }
 
+/**
+ * EvalAndAggregateVdfProofs evaluates every VDF and generates their aggregated
+ * proof in a single pass. The checkpoints stored while squaring are reused for
+ * the Wesolowski quotient, so the T squarings of PowFormWithQuotient are not
+ * repeated after evaluation.
+ * {ys, proof, b_iter} <- EvalAndAggregateVdfProofs(xs, t).
+ * @param D The discriminant of the class group.
+ * @param challenge_integers Contains all challenge_integers of VDFs.
+ * @param num_iterations The number of squaring of group operations.
+ * @param checkpoint_interval The number of squarings between two checkpoints,
+ *        0 picks it with ApproximateParameters.
+ * @param nthreads Is the number of threads used to evaluate and aggregate in parallel.
+ * @return states Contains the evaluated state (and y) of every VDF.
+ * @return proof Is the aggregated proof.
+ * @return b_iter Is the number of iterations to generate Fiat-Shamir challenge.
+*/
+std::tuple<std::vector<AggVdfState>, form, int> EvalAndAggregateVdfProofs(integer D,
+    std::vector<integer>& challenge_integers,
+    uint64_t num_iterations,
+    uint64_t checkpoint_interval = 0,
+    size_t nthreads = 1)
+{
+    int proofs_num = challenge_integers.size();
+    std::vector<AggVdfState> states(proofs_num);
+    std::vector<AggVdfState*> state_ptrs(proofs_num);
+    ParallelFor(proofs_num, nthreads, [&](const int bi, const int ei, const int tt) {
+        for (int i = bi; i < ei; i++) {
+            states[i] = EvalAggVdfWithCheckpoints(D, challenge_integers[i],
+                num_iterations, checkpoint_interval);
+        }
+    });
+    for (int i = 0; i < proofs_num; i++) {
+        state_ptrs[i] = &states[i];
+    }
+
+    form proof;
+    int b_iter;
+    tie(proof, b_iter) = AggreateVdfProofsFromStates(D, state_ptrs, num_iterations, nthreads);
+    return std::make_tuple(std::move(states), proof, b_iter);
+}
+
 /**
  * VerifyAggProof verifies the x, y, aggregated_proofs and returns a boolean.
  * This technique can only be used on VDFs in the same group (same discriminant).
@@ -160,24 +432,19 @@ bool VerifyAggProof(integer &D,
         threads[tt] = std::thread(std::bind(
         [&](const int bi, const int ei, const int tt)
         {
-            // PulmarkReducer and hash cannot be used as a shared variable in threads
+            // PulmarkReducer cannot be used as a shared variable in threads
             PulmarkReducer reducer;
-            std::vector<uint8_t> hash(picosha2::k_digest_size);  // output of sha256
-            form agg_xx = form::identity(D);
-            form agg_yy = form::identity(D);
+            std::vector<form> xx(gs.begin() + bi, gs.begin() + ei);
+            std::vector<form> yy(ys.begin() + bi, ys.begin() + ei);
+            std::vector<integer> alphas;
             for(int i = bi;i<ei;i++)
             {
-                std::vector<uint8_t> seed = int2bytes(i);
-                seed.insert(seed.end(), s.begin(), s.end());
-                picosha2::hash256(seed.begin(), seed.end(), hash.begin(), hash.end());
-                integer alpha(hash);
-                agg_xx = agg_xx * FastPowFormNucomp(gs[i], D, alpha, Lroot, reducer);
-                agg_yy = agg_yy * FastPowFormNucomp(ys[i], D, alpha, Lroot, reducer);        
+                alphas.push_back(AggregationAlpha(i, s));
             }
             // std::lock_guard<std::mutex> guard(g_pages_mutex);
             // do not use push_back or index racing will happend
-            agg_gs[tt] = agg_xx;
-            agg_ys[tt] = agg_yy;
+            agg_gs[tt] = MultiPowFormNucomp(xx, alphas, D, Lroot, reducer);
+            agg_ys[tt] = MultiPowFormNucomp(yy, alphas, D, Lroot, reducer);
         },tt*proofs_num/nthreads,(tt+1)==nthreads?proofs_num:(tt+1)*proofs_num/nthreads,tt));
     }
     std::for_each(threads.begin(),threads.end(),[](std::thread& x){x.join();});
@@ -189,9 +456,11 @@ bool VerifyAggProof(integer &D,
 
     // r <- 2^{T} / l = 2^{T} / B
     integer r = FastPow(2, num_iterations, B);
-    form f1 = FastPowFormNucomp(aggregated_proof, D, B, Lroot, reducer);
-    form f2 = FastPowFormNucomp(agg_x, D, r, Lroot, reducer);
-    if (f1 * f2 == agg_y)
+    // proof^B * agg_x^r
+    std::vector<form> lhs_bases = {aggregated_proof, agg_x};
+    std::vector<integer> lhs_exps = {B, r};
+    form lhs = MultiPowFormNucomp(lhs_bases, lhs_exps, D, Lroot, reducer);
+    if (lhs == agg_y)
     {
         return true;
     }
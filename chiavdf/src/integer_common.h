@@ -260,7 +260,8 @@ struct integer {
 
     string to_string_dec() const {
         string res_string;
-        res_string.resize(mpz_sizeinbase(impl, 10));
+        // room for a minus sign, mpz_sizeinbase doesn't count it
+        res_string.resize(mpz_sizeinbase(impl, 10) + 1);
 
         mpz_get_str(&(res_string[0]), 10, impl);
 
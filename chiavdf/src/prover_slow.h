@@ -29,12 +29,12 @@ uint64_t GetBlock(uint64_t i, uint64_t k, uint64_t T, integer& B) {
     return res_vector[0];
 }
 
-form GenerateWesolowski(form &y, form &x_init,
-                        integer &D, PulmarkReducer& reducer,
-                        std::vector<form> const& intermediates,
-                        uint64_t num_iterations,
-                        uint64_t k, uint64_t l) {
-    integer B = GetB(D, x_init, y);
+// Computes x^{floor(2^num_iterations / B)} from the checkpoints
+// intermediates[i] = x^{2^{i*k*l}} recorded while evaluating the VDF.
+form GenerateWesolowskiWithB(integer &B, integer &D, PulmarkReducer& reducer,
+                             std::vector<form> const& intermediates,
+                             uint64_t num_iterations,
+                             uint64_t k, uint64_t l) {
     integer L=root(-D, 4);
 
     uint64_t k1 = k / 2;
@@ -79,6 +79,15 @@ form GenerateWesolowski(form &y, form &x_init,
     return x;
 }
 
+form GenerateWesolowski(form &y, form &x_init,
+                        integer &D, PulmarkReducer& reducer,
+                        std::vector<form> const& intermediates,
+                        uint64_t num_iterations,
+                        uint64_t k, uint64_t l) {
+    integer B = GetB(D, x_init, y);
+    return GenerateWesolowskiWithB(B, D, reducer, intermediates, num_iterations, k, l);
+}
+
 std::vector<uint8_t> ProveSlow(integer& D, form& x, uint64_t num_iterations) {
     integer L = root(-D, 4);
     PulmarkReducer reducer;
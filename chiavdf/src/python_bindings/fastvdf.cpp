@@ -7,6 +7,14 @@
 
 namespace py = pybind11;
 
+// Appends the little endian iteration count that follows serialized forms.
+void AppendIter(std::vector<uint8_t> &serialized, int iters) {
+	serialized.push_back(iters & 0xff);
+	serialized.push_back((iters >> 8) & 0xff);
+	serialized.push_back((iters >> 16) & 0xff);
+	serialized.push_back((iters >> 24) & 0xff);
+}
+
 PYBIND11_MODULE(chiavdf, m) {
 	m.doc() = "Chia proof of time";
 
@@ -113,123 +121,258 @@ PYBIND11_MODULE(chiavdf, m) {
 		      return B.to_string();
 	      });
 
-	m.def("exp", [](const string &a_be, const string &b_be, const string &c_be,
-	                const py::list &exp_be_list) {
-		// a_be, b_be, c_be, exp_be are big endian bytes
+	m.def("exp", [](const string &a_dec, const string &b_dec,
+	                const string &c_dec, const py::list &exp_be_list) {
+		// a_dec, b_dec, c_dec are decimal strings, b may be negative
 		// exp_be_list is a list of big endian bytes
-		// returns a tuple of big endian bytes
+		// returns a tuple of (a, b, c) decimal strings
+		auto exps = exp_be_list.cast<std::vector<string>>();
 		string str_a, str_b, str_c;
 		{
 			py::gil_scoped_release release;
-			integer a, b, c;
-			mpz_import(a.impl, a_be.size(), 1, 1, 1, 0, a_be.data());
-			mpz_import(b.impl, b_be.size(), 1, 1, 1, 0, b_be.data());
-			mpz_import(c.impl, c_be.size(), 1, 1, 1, 0, c_be.data());
+			integer a(a_dec), b(b_dec), c(c_dec);
 			integer D = b * b - integer(4) * a * c;
 			integer L = root(-D, 4);
 			form x = form::from_abc(a, b, c);
 			PulmarkReducer reducer;
 
-			auto exps = exp_be_list.cast<std::vector<string>>();
 			for (auto &exp_be : exps) {
 				integer exp;
 				mpz_import(exp.impl, exp_be.size(), 1, 1, 1, 0, exp_be.data());
 				x = FastPowFormNucomp(x, D, exp, L, reducer);
 			}
-			auto res_a = x.a.to_bytes();
-			auto res_b = x.b.to_bytes();
-			auto res_c = x.c.to_bytes();
-			str_a = string(res_a.begin(), res_a.end());
-			str_b = string(res_b.begin(), res_b.end());
-			str_c = string(res_c.begin(), res_c.end());
+			// decimal rather than to_bytes, which drops the sign of b
+			str_a = x.a.to_string_dec();
+			str_b = x.b.to_string_dec();
+			str_c = x.c.to_string_dec();
 		}
-		return py::make_tuple(py::bytes(str_a), py::bytes(str_b),
-		                      py::bytes(str_c));
+		return py::make_tuple(str_a, str_b, str_c);
 	});
 
-	m.def("aggvdf_eval", [](const string &d_be, const uint64_t num_iterations,
-	                        const py::list &challenges_be_list) {
+	m.def("multi_exp", [](const std::vector<std::tuple<string, string, string>>
+	                          &bases_abc,
+	                      const std::vector<string> &exp_be_list) {
+		// bases_abc is a list of (a, b, c) decimal strings, b may be negative
+		// exp_be_list is a list of big endian bytes, one per base
+		// returns prod base_i^exp_i as a tuple of (a, b, c) decimal strings
+		if (bases_abc.size() != exp_be_list.size() || bases_abc.empty()) {
+			throw std::invalid_argument(
+			    "expected the same, non-zero number of bases and exponents");
+		}
+		string str_a, str_b, str_c;
 		{
 			py::gil_scoped_release release;
-			integer D;
-			mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
-			D = -D;
-			int d_bits = D.num_bits();
-
-			auto challenges = challenges_be_list.cast<std::vector<string>>();
-			std::vector<form> ys(challenges.size());
-			std::vector<py::bytes> results(challenges.size());
-			for (int i = 0; i < challenges.size(); i++) {
-				auto &challenge_be = challenges[i];
-				integer challenge;
-				mpz_import(challenge.impl, challenge_be.size(), 1, 1, 1, 0,
-				           challenge_be.data());
-				form y;
-				int iters;
-				std::tie(y, iters) = EvalAggVdf(D, challenge, num_iterations);
-				auto serialized = SerializeForm(y, d_bits);
-				serialized.push_back(iters & 0xff);
-				serialized.push_back((iters >> 8) & 0xff);
-				serialized.push_back((iters >> 16) & 0xff);
-				serialized.push_back((iters >> 24) & 0xff);
-				{
-					py::gil_scoped_acquire acquire;
-					results[i] =
-					    py::bytes(reinterpret_cast<char *>(serialized.data()),
-					              serialized.size());
-				}
+			std::vector<form> bases;
+			std::vector<integer> exps;
+			for (int i = 0; i < bases_abc.size(); i++) {
+				integer a(std::get<0>(bases_abc[i]));
+				integer b(std::get<1>(bases_abc[i]));
+				integer c(std::get<2>(bases_abc[i]));
+				bases.push_back(form::from_abc(a, b, c));
+				integer exp;
+				mpz_import(exp.impl, exp_be_list[i].size(), 1, 1, 1, 0,
+				           exp_be_list[i].data());
+				exps.push_back(exp);
 			}
-			return results;
+			integer D = bases[0].b * bases[0].b -
+			            integer(4) * bases[0].a * bases[0].c;
+			integer L = root(-D, 4);
+			PulmarkReducer reducer;
+			form x = MultiPowFormNucomp(bases, exps, D, L, reducer);
+			str_a = x.a.to_string_dec();
+			str_b = x.b.to_string_dec();
+			str_c = x.c.to_string_dec();
 		}
+		return py::make_tuple(str_a, str_b, str_c);
 	});
 
-	m.def("aggvdf_prove", [](const string &d_be, const uint64_t num_iterations,
-	                         const py::list &challenges_be_list,
-	                         const py::list &ys_serialized_list) {
-		{
-			py::gil_scoped_release release;
-			integer D;
-			mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
-			D = -D;
-			int d_bits = D.num_bits();
+	m.def(
+	    "aggvdf_eval",
+	    [](const string &d_be, const uint64_t num_iterations,
+	       const py::list &challenges_be_list, const size_t nthreads) {
+		    auto challenges = challenges_be_list.cast<std::vector<string>>();
+		    std::vector<std::vector<uint8_t>> serialized(challenges.size());
+		    {
+			    py::gil_scoped_release release;
+			    integer D;
+			    mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
+			    D = -D;
+			    int d_bits = D.num_bits();
 
-			auto challenges = challenges_be_list.cast<std::vector<string>>();
-			auto ys_serialized = ys_serialized_list.cast<std::vector<string>>();
-			std::vector<integer> challenge_integers(challenges.size());
-			std::vector<form> ys(ys_serialized.size());
-			std::vector<int> a_iters(ys_serialized.size());
-			for (int i = 0; i < ys_serialized.size(); i++) {
-				auto &y_serialized = ys_serialized[i];
-				auto &challenge_be = challenges[i];
-				mpz_import(challenge_integers[i].impl, challenge_be.size(), 1,
-				           1, 1, 0, challenge_be.data());
-				// extract a_iters from serialized y
-				int a_iters_offset = y_serialized.size() - 4;
-				a_iters[i] = (y_serialized[a_iters_offset] & 0xff) |
-				             ((y_serialized[a_iters_offset + 1] & 0xff) << 8) |
-				             ((y_serialized[a_iters_offset + 2] & 0xff) << 16) |
-				             ((y_serialized[a_iters_offset + 3] & 0xff) << 24);
-				y_serialized.resize(a_iters_offset);
-				// deserialize y
-				ys[i] = DeserializeForm(D, (const uint8_t *)y_serialized.data(),
-				                        y_serialized.size());
-			}
-			form aggregated_proof;
-			int b_iter;
-			tie(aggregated_proof, b_iter) = AggreateVdfProofs(
-			    D, challenge_integers, ys, num_iterations, a_iters);
-			auto serialized = SerializeForm(aggregated_proof, d_bits);
-			serialized.push_back(b_iter & 0xff);
-			serialized.push_back((b_iter >> 8) & 0xff);
-			serialized.push_back((b_iter >> 16) & 0xff);
-			serialized.push_back((b_iter >> 24) & 0xff);
-			{
-				py::gil_scoped_acquire acquire;
-				return py::bytes(reinterpret_cast<char *>(serialized.data()),
-				                 serialized.size());
-			}
-		}
-	});
+			    std::vector<integer> challenge_integers(challenges.size());
+			    for (int i = 0; i < challenges.size(); i++) {
+				    auto &challenge_be = challenges[i];
+				    mpz_import(challenge_integers[i].impl, challenge_be.size(),
+				               1, 1, 1, 0, challenge_be.data());
+			    }
+			    auto results = EvalAggVdfs(D, challenge_integers,
+			                               num_iterations, nthreads);
+			    for (int i = 0; i < results.size(); i++) {
+				    form y;
+				    int iters;
+				    std::tie(y, iters) = results[i];
+				    serialized[i] = SerializeForm(y, d_bits);
+				    AppendIter(serialized[i], iters);
+			    }
+		    }
+		    std::vector<py::bytes> results;
+		    results.reserve(serialized.size());
+		    for (auto &y : serialized) {
+			    results.emplace_back(reinterpret_cast<char *>(y.data()),
+			                         y.size());
+		    }
+		    return results;
+	    },
+	    py::arg("d"), py::arg("num_iterations"), py::arg("challenges"),
+	    py::arg("nthreads") = 1);
+
+	// Cached per-VDF state for incremental aggregation, see AggVdfState.
+	py::class_<AggVdfState>(m, "AggVdfState")
+	    .def_property_readonly("y", [](const AggVdfState &state) {
+		    std::vector<uint8_t> serialized = state.y_bytes;
+		    AppendIter(serialized, state.a_iter);
+		    return py::bytes(reinterpret_cast<char *>(serialized.data()),
+		                     serialized.size());
+	    });
+
+	m.def(
+	    "aggvdf_eval_state",
+	    [](const string &d_be, const uint64_t num_iterations,
+	       const string &challenge_be, const uint64_t checkpoint_interval) {
+		    py::gil_scoped_release release;
+		    integer D;
+		    mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
+		    D = -D;
+		    integer challenge;
+		    mpz_import(challenge.impl, challenge_be.size(), 1, 1, 1, 0,
+		               challenge_be.data());
+		    return EvalAggVdfWithCheckpoints(D, challenge, num_iterations,
+		                                     checkpoint_interval);
+	    },
+	    py::arg("d"), py::arg("num_iterations"), py::arg("challenge"),
+	    py::arg("checkpoint_interval") = 0);
+
+	// Evaluates the challenges and aggregates their proof in one pass,
+	// returns a tuple of (ys, proof) in the aggvdf_eval/aggvdf_prove formats.
+	m.def(
+	    "aggvdf_eval_and_prove",
+	    [](const string &d_be, const uint64_t num_iterations,
+	       const py::list &challenges_be_list,
+	       const uint64_t checkpoint_interval, const size_t nthreads) {
+		    auto challenges = challenges_be_list.cast<std::vector<string>>();
+		    std::vector<std::vector<uint8_t>> ys_serialized(challenges.size());
+		    std::vector<uint8_t> proof_serialized;
+		    {
+			    py::gil_scoped_release release;
+			    integer D;
+			    mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
+			    D = -D;
+			    int d_bits = D.num_bits();
+
+			    std::vector<integer> challenge_integers(challenges.size());
+			    for (int i = 0; i < challenges.size(); i++) {
+				    mpz_import(challenge_integers[i].impl, challenges[i].size(),
+				               1, 1, 1, 0, challenges[i].data());
+			    }
+			    std::vector<AggVdfState> states;
+			    form aggregated_proof;
+			    int b_iter;
+			    tie(states, aggregated_proof, b_iter) =
+			        EvalAndAggregateVdfProofs(D, challenge_integers,
+			                                  num_iterations, checkpoint_interval,
+			                                  nthreads);
+			    for (int i = 0; i < states.size(); i++) {
+				    ys_serialized[i] = states[i].y_bytes;
+				    AppendIter(ys_serialized[i], states[i].a_iter);
+			    }
+			    proof_serialized = SerializeForm(aggregated_proof, d_bits);
+			    AppendIter(proof_serialized, b_iter);
+		    }
+		    py::list ys;
+		    for (auto &y : ys_serialized) {
+			    ys.append(py::bytes(reinterpret_cast<char *>(y.data()), y.size()));
+		    }
+		    py::bytes proof(reinterpret_cast<char *>(proof_serialized.data()),
+		                    proof_serialized.size());
+		    return py::make_tuple(ys, proof);
+	    },
+	    py::arg("d"), py::arg("num_iterations"), py::arg("challenges"),
+	    py::arg("checkpoint_interval") = 0, py::arg("nthreads") = 1);
+
+	m.def(
+	    "aggvdf_prove_states",
+	    [](const string &d_be, const uint64_t num_iterations,
+	       std::vector<AggVdfState *> states, const size_t nthreads) {
+		    std::vector<uint8_t> serialized;
+		    {
+			    py::gil_scoped_release release;
+			    integer D;
+			    mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
+			    D = -D;
+			    int d_bits = D.num_bits();
+
+			    form aggregated_proof;
+			    int b_iter;
+			    tie(aggregated_proof, b_iter) = AggreateVdfProofsFromStates(
+			        D, states, num_iterations, nthreads);
+			    serialized = SerializeForm(aggregated_proof, d_bits);
+			    AppendIter(serialized, b_iter);
+		    }
+		    return py::bytes(reinterpret_cast<char *>(serialized.data()),
+		                     serialized.size());
+	    },
+	    py::arg("d"), py::arg("num_iterations"), py::arg("states"),
+	    py::arg("nthreads") = 1);
+
+	m.def(
+	    "aggvdf_prove",
+	    [](const string &d_be, const uint64_t num_iterations,
+	       const py::list &challenges_be_list,
+	       const py::list &ys_serialized_list, const size_t nthreads) {
+		    auto challenges = challenges_be_list.cast<std::vector<string>>();
+		    auto ys_serialized = ys_serialized_list.cast<std::vector<string>>();
+		    std::vector<uint8_t> serialized;
+		    {
+			    py::gil_scoped_release release;
+			    integer D;
+			    mpz_import(D.impl, d_be.size(), 1, 1, 1, 0, d_be.data());
+			    D = -D;
+			    int d_bits = D.num_bits();
+
+			    std::vector<integer> challenge_integers(challenges.size());
+			    std::vector<form> ys(ys_serialized.size());
+			    std::vector<int> a_iters(ys_serialized.size());
+			    for (int i = 0; i < ys_serialized.size(); i++) {
+				    auto &y_serialized = ys_serialized[i];
+				    auto &challenge_be = challenges[i];
+				    mpz_import(challenge_integers[i].impl, challenge_be.size(),
+				               1, 1, 1, 0, challenge_be.data());
+				    // extract a_iters from serialized y
+				    int a_iters_offset = y_serialized.size() - 4;
+				    a_iters[i] =
+				        (y_serialized[a_iters_offset] & 0xff) |
+				        ((y_serialized[a_iters_offset + 1] & 0xff) << 8) |
+				        ((y_serialized[a_iters_offset + 2] & 0xff) << 16) |
+				        ((y_serialized[a_iters_offset + 3] & 0xff) << 24);
+				    y_serialized.resize(a_iters_offset);
+				    // deserialize y
+				    ys[i] = DeserializeForm(D,
+				                            (const uint8_t *)y_serialized.data(),
+				                            y_serialized.size());
+			    }
+			    form aggregated_proof;
+			    int b_iter;
+			    tie(aggregated_proof, b_iter) =
+			        AggreateVdfProofs(D, challenge_integers, ys, num_iterations,
+			                          a_iters, nthreads);
+			    serialized = SerializeForm(aggregated_proof, d_bits);
+			    AppendIter(serialized, b_iter);
+		    }
+		    return py::bytes(reinterpret_cast<char *>(serialized.data()),
+		                     serialized.size());
+	    },
+	    py::arg("d"), py::arg("num_iterations"), py::arg("challenges"),
+	    py::arg("ys"), py::arg("nthreads") = 1);
 
 	m.def("aggvdf_verify", [](const string &d_be, const uint64_t num_iterations,
 	                          const py::list &challenges_be_list,
@@ -274,7 +274,8 @@ template<int d_expected_size, int d_padded_size> struct alignas(64) mpz {
 
     USED string to_string_dec() const {
         string res_string;
-        res_string.resize(mpz_sizeinbase(*this, 10));
+        // room for a minus sign, mpz_sizeinbase doesn't count it
+        res_string.resize(mpz_sizeinbase(*this, 10) + 1);
 
         mpz_get_str(&(res_string[0]), 10, *this);
 
@@ -1,5 +1,6 @@
 from abc import ABCMeta, abstractmethod
 from typing import TypeVar, Generic
+import msgpack
 
 EvalAndProofT = TypeVar("EvalAndProofT")
 
@@ -39,6 +40,10 @@ class AggregateVDF(Generic[EvalT, ProofT], metaclass=ABCMeta):
     def verify(self, challenges: list[bytes], ys: list[EvalT], proof: ProofT) -> bool:
         pass
 
+    def eval_and_aggregate(self, challenges: list[bytes]) -> tuple[list[EvalT], ProofT]:
+        ys = self.eval(challenges)
+        return ys, self.aggregate(challenges, ys)
+
 
 AccumulatorT = TypeVar("AccumulatorT")
 AccumulationValueT = TypeVar("AccumulationValueT")
@@ -72,6 +77,39 @@ class AbstractAccumulator(
     def get_bytes(self, accval: AccumulationValueT) -> bytes:
         pass
 
+    # one result per (witness, element) pair, accumulators with a cheaper way
+    # to check many witnesses against the same value override this
+    def verify_batch(
+        self, accval: AccumulationValueT, items: list[tuple[WitnessT, bytes]]
+    ) -> list[bool]:
+        return [self.verify(accval, w, x) for w, x in items]
+
+    # wire encoding of a single witness, used by the compact accproof format.
+    # The default is msgpack, accumulators whose witnesses msgpack can't
+    # encode, or can encode more tightly, override both.
+    def pack_witness(self, w: WitnessT) -> bytes:
+        return msgpack.packb(w)
+
+    def unpack_witness(self, data: bytes) -> WitnessT:
+        return msgpack.unpackb(data)
+
+    # streaming interface: init, then update for each element, then finalize
+    # gives the same result as accumulate. Accumulators that can do the work as
+    # elements arrive override these, the default just defers to accumulate.
+    def init(self):
+        return []
+
+    def update(self, state, x: bytes):
+        state.append(x)
+
+    def finalize(self, state) -> AccumulatorT:
+        return self.accumulate(state)
+
+    # called in the background once X is final, accumulators with expensive
+    # witness generation can compute all the witnesses ahead of the requests
+    def prepare(self, acc: AccumulatorT, X: list[bytes]):
+        pass
+
 
 NonMemWitnessT = TypeVar("NonMemWitnessT")
 
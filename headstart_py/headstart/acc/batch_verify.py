@@ -0,0 +1,44 @@
+import secrets
+from typing import Callable, TypeVar
+
+# Small-exponent batch verification (Bellare-Garay-Rabin): instead of checking
+# w_i^x_i == acc for every item, check prod w_i^(x_i r_i) == acc^(sum r_i) for
+# random SECURITY_BITS-bit r_i, which is one multi-exponentiation. A batch with
+# a bad item passes with probability about 2^-SECURITY_BITS, as long as nobody
+# knows elements of small order in the group (see RSAAccumulator.verify_batch).
+
+SECURITY_BITS = 64
+
+T = TypeVar("T")
+
+
+def random_exponents(n: int) -> list[int]:
+    return [secrets.randbits(SECURITY_BITS) for _ in range(n)]
+
+
+def bisect_verify(
+    items: list[T],
+    check_batch: Callable[[list[T]], bool],
+    check_one: Callable[[T], bool],
+    cutoff: int = 4,
+) -> list[bool]:
+    """
+    Verify every item, returning one result per item. Batches that fail are
+    split in half until the bad items are found, and batches of at most
+    `cutoff` items are checked one by one.
+    """
+    ok = [False] * len(items)
+
+    def go(lo: int, hi: int):
+        if hi - lo <= cutoff:
+            for i in range(lo, hi):
+                ok[i] = check_one(items[i])
+        elif check_batch(items[lo:hi]):
+            ok[lo:hi] = [True] * (hi - lo)
+        else:
+            mid = (lo + hi) // 2
+            go(lo, mid)
+            go(mid, hi)
+
+    go(0, len(items))
+    return ok
@@ -5,56 +5,119 @@ from Crypto.Util.number import (
     bytes_to_long,
     long_to_bytes,
 )
-from headstart.math.bqf import BinaryQF, qf_pow, qf_tobytes
+from headstart.math.bqf import (
+    BinaryQF,
+    qf_pow,
+    qf_multi_pow,
+    qf_tobytes,
+    qf_frombytes,
+)
 from headstart.abstract import AbstractAccumulator
+from headstart.acc.witness_cache import WitnessCache
+from headstart.acc.root_factor import root_factor, collect
+from headstart.acc.batch_verify import bisect_verify, random_exponents
+from concurrent.futures import Executor
+from typing import Generator, Optional
 import chiavdf
 
 
 class BQFAccumulator(AbstractAccumulator[BinaryQF, BinaryQF, BinaryQF]):
-    def __init__(self, g: BinaryQF):
+    def __init__(self, g: BinaryQF, executor: Optional[Executor] = None):
         self.d = g.discriminant()
         self.g = g
-        self.witness_cache = {}
+        self.witness_cache = WitnessCache()
+        # batch_witgen runs on this if given, see headstart.acc.root_factor
+        self.executor = executor
+
+    def __getstate__(self):
+        # the cache and the executor stay in this process, e.g. when the
+        # accumulator is sent to the executor's workers
+        state = self.__dict__.copy()
+        del state["witness_cache"], state["executor"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.witness_cache = WitnessCache()
+        self.executor = None
 
     def accumulate(self, X: list[bytes]) -> BinaryQF:
-        r = self.g
+        return self.exp(self.g, X)
+
+    def exp(self, g: BinaryQF, X: list[bytes]) -> BinaryQF:
         for x in X:
-            r = qf_pow(r, bytes_to_long(x))
-        return r
-
-    def batch_witgen(self, X: list[bytes]) -> list[int]:
-        def root_factor(g, X):
-            if len(X) == 1:
-                return [g]
-            h = len(X) // 2
-            gl = g
-            for x in X[:h]:
-                gl = qf_pow(gl, bytes_to_long(x))
-            gr = g
-            for x in X[h:]:
-                gr = qf_pow(gr, bytes_to_long(x))
-            L = root_factor(gr, X[:h])
-            R = root_factor(gl, X[h:])
-            return L + R
-
-        return root_factor(self.g, X)
+            g = qf_pow(g, bytes_to_long(x))
+        return g
+
+    def iter_witgen(
+        self, X: list[bytes]
+    ) -> Generator[tuple[int, BinaryQF], None, None]:
+        # (index, witness) pairs as they are computed
+        return root_factor(self.exp, self.g, X, self.executor)
+
+    def batch_witgen(self, X: list[bytes]) -> list[BinaryQF]:
+        return collect(self.iter_witgen(X), len(X))
+
+    def witnesses(self, acc: BinaryQF, X: list[bytes]) -> list[BinaryQF]:
+        return self.witness_cache.get(
+            self.get_bytes(acc),
+            X,
+            lambda: self.batch_witgen(X),
+            # three coefficients of about the size of the discriminant
+            len(X) * 3 * ((self.d.bit_length() + 7) // 8),
+        )
 
     def witgen(self, acc: BinaryQF, X: list[bytes], index: int) -> BinaryQF:
-        cache_key = hash(tuple(X))
-        if cache_key not in self.witness_cache:
-            self.witness_cache[cache_key] = self.batch_witgen(X)
-        witness_cache = self.witness_cache[cache_key]
-        return witness_cache[index]
+        return self.witnesses(acc, X)[index]
+
+    def prepare(self, acc: BinaryQF, X: list[bytes]):
+        self.witnesses(acc, X)
 
     def verify(self, acc: BinaryQF, w: BinaryQF, x: bytes) -> bool:
         return qf_pow(w, bytes_to_long(x)) == acc
 
+    def multi_exp(self, gs: list[BinaryQF], exps: list[int]) -> BinaryQF:
+        return qf_multi_pow(gs, exps)
+
+    def check_batch(self, acc: BinaryQF, items: list[tuple[BinaryQF, bytes]]) -> bool:
+        rs = random_exponents(len(items))
+        lhs = self.multi_exp(
+            [w for w, _ in items],
+            [bytes_to_long(x) * r for (_, x), r in zip(items, rs)],
+        )
+        return lhs == self.exp(acc, [int2bytes(sum(rs))])
+
+    def verify_batch(
+        self, acc: BinaryQF, items: list[tuple[BinaryQF, bytes]]
+    ) -> list[bool]:
+        # the discriminant is a negative prime, so the class number is odd and
+        # there are no elements of order 2
+        return bisect_verify(
+            items,
+            lambda batch: self.check_batch(acc, batch),
+            lambda item: self.verify(acc, *item),
+        )
+
     def get_accval(self, acc: BinaryQF) -> BinaryQF:
         return acc
 
     def get_bytes(self, acc: BinaryQF) -> bytes:
         return qf_tobytes(acc, self.d.bit_length())
 
+    @property
+    def witness_bits(self) -> int:
+        # whole bytes with room for the sign, so any coefficient of a
+        # reduced form fits
+        return (self.d.bit_length() + 8) // 8 * 8
+
+    def pack_witness(self, w: BinaryQF) -> bytes:
+        return qf_tobytes(w, self.witness_bits)
+
+    def unpack_witness(self, data: bytes) -> BinaryQF:
+        if len(data) != 3 * self.witness_bits // 8:
+            raise ValueError("invalid witness")
+        return qf_frombytes(data, self.witness_bits)
+
     @classmethod
     def generate(cls, bits):
         while True:
@@ -79,33 +142,24 @@ def int2bytes(x):
     return int(x).to_bytes((x.bit_length() + 7) // 8, "big")
 
 
-def bytes2int(x):
-    return int.from_bytes(x, "big")
+def chai_exp(g: BinaryQF, exps: list[bytes]):
+    a, b, c = chiavdf.exp(str(g.a), str(g.b), str(g.c), exps)
+    return BinaryQF(int(a), int(b), int(c))
 
 
-def chai_exp(g: BinaryQF, exps: list[bytes]):
-    a, b, c = map(
-        bytes2int, chiavdf.exp(int2bytes(g.a), int2bytes(g.b), int2bytes(g.c), exps)
+def chai_multi_exp(gs: list[BinaryQF], exps: list[int]) -> BinaryQF:
+    a, b, c = chiavdf.multi_exp(
+        [(str(g.a), str(g.b), str(g.c)) for g in gs], [int2bytes(e) for e in exps]
     )
-    return BinaryQF(a, b, c)
+    return BinaryQF(int(a), int(b), int(c))
 
 
 class ChiaBQFAccumulator(BQFAccumulator):
-    def accumulate(self, X: list[bytes]) -> BinaryQF:
-        return chai_exp(self.g, X)
-
-    def batch_witgen(self, X: list[bytes]) -> list[int]:
-        def root_factor(g, X):
-            if len(X) == 1:
-                return [g]
-            h = len(X) // 2
-            gl = chai_exp(g, X[:h])
-            gr = chai_exp(g, X[h:])
-            L = root_factor(gr, X[:h])
-            R = root_factor(gl, X[h:])
-            return L + R
+    def multi_exp(self, gs: list[BinaryQF], exps: list[int]) -> BinaryQF:
+        return chai_multi_exp(gs, exps)
 
-        return root_factor(self.g, X)
+    def exp(self, g: BinaryQF, X: list[bytes]) -> BinaryQF:
+        return chai_exp(g, X)
 
     # def witgen(self, acc: BinaryQF, X: list[bytes], index: int) -> BinaryQF:
     #     return chai_exp(self.g, X[:index] + X[index + 1 :])
@@ -124,6 +178,14 @@ if __name__ == "__main__":
         assert acc.verify(accval, w, X[1])
         print(acc.get_bytes(accval).hex())
 
+        X = [b"peko%d" % i for i in range(12)]
+        accval = acc.get_accval(acc.accumulate(X))
+        items = list(zip(acc.batch_witgen(X), X))
+        assert acc.verify_batch(accval, items) == [True] * len(X)
+        # a witness for another element
+        items[5] = (items[6][0], X[5])
+        assert acc.verify_batch(accval, items) == [i != 5 for i in range(len(X))]
+
     g = BQFAccumulator.generate(1024).g
     test(BQFAccumulator(g))
     test(ChiaBQFAccumulator(g))
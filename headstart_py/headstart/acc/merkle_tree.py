@@ -1,14 +1,15 @@
 from hashlib import sha256
 from headstart.abstract import AbstractAccumulator, AbstractUniversalAccumulator
-from typing import Optional
+from typing import Optional, Union
 from dataclasses import dataclass
-import bisect
+import bisect, struct
 
 
 class MerkleHash:
     # https://crypto.stackexchange.com/questions/2106/what-is-the-purpose-of-using-different-hash-functions-for-the-leaves-and-interna
     def __init__(self, hashfn):
         self.hashfn = hashfn
+        self.size = hashfn().digest_size
 
     def hash_leaf(self, x: bytes) -> bytes:
         return self.hashfn(b"\x00" + x).digest()
@@ -17,31 +18,80 @@ class MerkleHash:
         return self.hashfn(b"\x01" + x + y).digest()
 
 
+# Trees are stored flat: node i of a tree lives at tree[i * size : (i + 1) * size]
+# of a single bytearray, in heap order (children of i are 2i + 1 and 2i + 2, so
+# siblings are adjacent). Proofs are memoryview slices into that buffer.
+#
+# Compact encodings, used on the wire:
+#   proof:      depth u8 | directions | siblings
+#               directions is a (depth + 7) // 8 byte big-endian bitmask, bit k
+#               is set if the sibling at height k is on the left
+#   multiproof: depth u8 | sibling count u32 | siblings
+#               the siblings that can't be computed from the proven leaves, in
+#               the order multiproof_siblings visits them
+
+MULTIPROOF_PREFIX = struct.Struct(">BI")
+
+
+def multiproof_siblings(depth: int, indices: list[int], node) -> list:
+    """
+    Siblings needed to prove the leaves at `indices` of a tree with the given
+    depth, where `node(k, j)` is node j at height k. Nodes shared between the
+    paths, or computable from other proven leaves, are only included once.
+    """
+    known = sorted(set(indices))
+    if known and not (0 <= known[0] and known[-1] < 1 << depth):
+        raise ValueError("invalid data index")
+    siblings = []
+    for k in range(depth):
+        parents = []
+        i = 0
+        while i < len(known):
+            j = known[i]
+            if j % 2 == 0 and i + 1 < len(known) and known[i + 1] == j + 1:
+                i += 2
+            else:
+                siblings.append(node(k, j ^ 1))
+                i += 1
+            parents.append(j >> 1)
+        known = parents
+    return siblings
+
+
 class MerkleTree:
     def __init__(
         self,
         H: MerkleHash,
-        tree: list[bytes],
+        tree: Union[bytes, bytearray, list[bytes]],
         data: Optional[list[bytes]] = None,
         *,
         verify_data=True
     ):
         self.H = H
+        if isinstance(tree, list):
+            tree = bytearray().join(tree)
+        elif not isinstance(tree, bytearray):
+            tree = bytearray(tree)
+        # a bytearray is used as is, compute_tree's output is never copied
         self.tree = tree
-        self.lendata = (len(tree) + 1) // 2
+        self.nodes = memoryview(self.tree)
+        self.lendata = (len(self.tree) // H.size + 1) // 2
         self.data = data
         if data is not None and verify_data:
             self.verify_data()
 
+    def node(self, i: int) -> memoryview:
+        return self.nodes[i * self.H.size : (i + 1) * self.H.size]
+
     @property
     def root(self):
-        return self.tree[0]
+        return bytes(self.node(0))
 
     def verify_data(self):
         l = len(self.data)
         if l & (l - 1) != 0:
             raise ValueError("data length must be a power of 2")
-        if len(self.tree) != 2 * len(self.data) - 1:
+        if len(self.tree) != (2 * len(self.data) - 1) * self.H.size:
             raise ValueError("tree length must be 2 * len(data) - 1")
         if MerkleTree.compute_tree(self.H, self.data) != self.tree:
             raise ValueError("invalid tree")
@@ -51,23 +101,111 @@ class MerkleTree:
         cur = index + self.lendata - 1
         while cur > 0:
             if cur & 1:  # left
-                x = self.H.hash_node(x, self.tree[cur + 1])
+                x = self.H.hash_node(x, self.node(cur + 1))
             else:  # right
-                x = self.H.hash_node(self.tree[cur - 1], x)
+                x = self.H.hash_node(self.node(cur - 1), x)
             cur = (cur - 1) // 2
         return x == self.root
 
-    def get_proof(self, index: int) -> list[tuple[str, bytes]]:
+    def get_proof(self, index: int) -> list[tuple[str, memoryview]]:
         cur = index + self.lendata - 1
         ret = []
         while cur > 0:
             if cur & 1:
-                ret.append(("R", self.tree[cur + 1]))
+                ret.append(("R", self.node(cur + 1)))
             else:
-                ret.append(("L", self.tree[cur - 1]))
+                ret.append(("L", self.node(cur - 1)))
             cur = (cur - 1) // 2
         return ret
 
+    def node_at(self, k: int, j: int) -> memoryview:
+        # node j at height k
+        depth = self.lendata.bit_length() - 1
+        return self.node((1 << (depth - k)) - 1 + j)
+
+    def get_multiproof(self, indices: list[int]) -> bytes:
+        depth = self.lendata.bit_length() - 1
+        siblings = multiproof_siblings(depth, indices, self.node_at)
+        return MULTIPROOF_PREFIX.pack(depth, len(siblings)) + b"".join(siblings)
+
+    @staticmethod
+    def pack_proof(proof: list[tuple[str, bytes]]) -> bytes:
+        directions = 0
+        for k, (side, _) in enumerate(proof):
+            if side == "L":
+                directions |= 1 << k
+            elif side != "R":
+                raise ValueError("invalid proof")
+        return (
+            bytes([len(proof)])
+            + directions.to_bytes((len(proof) + 7) // 8, "big")
+            + b"".join(h for _, h in proof)
+        )
+
+    @staticmethod
+    def unpack_proof(H: MerkleHash, data: bytes) -> list[tuple[str, bytes]]:
+        if not data:
+            raise ValueError("invalid proof")
+        depth = data[0]
+        off = 1 + (depth + 7) // 8
+        if len(data) != off + depth * H.size:
+            raise ValueError("invalid proof")
+        directions = int.from_bytes(data[1:off], "big")
+        ret = []
+        for k in range(depth):
+            side = "L" if directions >> k & 1 else "R"
+            ret.append((side, data[off + k * H.size : off + (k + 1) * H.size]))
+        return ret
+
+    @staticmethod
+    def check_multiproof(
+        H: MerkleHash, root: bytes, proof: bytes, leaves: list[tuple[int, bytes]]
+    ) -> bool:
+        """
+        Check that each `(index, x)` in `leaves` is in the tree with the given
+        root, using a multiproof from `get_multiproof`.
+        """
+        if len(proof) < MULTIPROOF_PREFIX.size:
+            return False
+        depth, count = MULTIPROOF_PREFIX.unpack_from(proof)
+        if len(proof) != MULTIPROOF_PREFIX.size + count * H.size:
+            return False
+        hashes: dict[int, bytes] = {}
+        for j, x in leaves:
+            h = H.hash_leaf(x)
+            if not (0 <= j < 1 << depth) or hashes.setdefault(j, h) != h:
+                return False
+        nodes = sorted(hashes.items())
+        if not nodes:
+            return False
+        off = MULTIPROOF_PREFIX.size
+        for _ in range(depth):
+            parents = []
+            i = 0
+            while i < len(nodes):
+                j, h = nodes[i]
+                if j % 2 == 0 and i + 1 < len(nodes) and nodes[i + 1][0] == j + 1:
+                    parent = H.hash_node(h, nodes[i + 1][1])
+                    i += 2
+                else:
+                    if off >= len(proof):
+                        return False
+                    sibling = proof[off : off + H.size]
+                    off += H.size
+                    if j % 2 == 0:
+                        parent = H.hash_node(h, sibling)
+                    else:
+                        parent = H.hash_node(sibling, h)
+                    i += 1
+                parents.append((j >> 1, parent))
+            nodes = parents
+        return off == len(proof) and nodes == [(0, root)]
+
+    @staticmethod
+    def detach_proof(proof: list[tuple[str, memoryview]]) -> list[tuple[str, bytes]]:
+        # copy a proof out of the tree buffer, e.g. to serialize it
+        return [(side, bytes(h)) for side, h in proof]
+
     @staticmethod
     def check_proof(
         H: MerkleHash, root: bytes, x: bytes, index: int, proof: list[tuple[str, bytes]]
@@ -83,25 +221,152 @@ class MerkleTree:
         return x == root
 
     @staticmethod
-    def compute_tree(H: MerkleHash, data: list[bytes]):
-        l = len(data)
+    def hash_level(H: MerkleHash, level: bytes) -> bytes:
+        # hash each adjacent pair of nodes in a flat level into their parent.
+        # Every node starts from a copy of a hasher that already absorbed the
+        # prefix and is fed a view of the level, so no node input is built.
+        new = H.hashfn(b"\x01").copy
+        step = 2 * H.size
+        nodes = memoryview(level)
+        out = []
+        append = out.append
+        for i in range(0, len(level), step):
+            h = new()
+            h.update(nodes[i : i + step])
+            append(h.digest())
+        return b"".join(out)
+
+    @staticmethod
+    def hash_levels(H: MerkleHash, data: list[bytes], size: int) -> list[bytes]:
+        """
+        The flat levels of the tree over `data` padded to `size` leaves, from
+        the leaves up to the root.
+        """
+        new = H.hashfn(b"\x00").copy
+        out = []
+        append = out.append
+        for x in data:
+            h = new()
+            h.update(x)
+            append(h.digest())
+        level = b"".join(out)
+        del out
+        if len(data) < size:
+            level += H.hash_leaf(b"") * (size - len(data))
+        levels = [level]
+        while len(level) > H.size:
+            level = MerkleTree.hash_level(H, level)
+            levels.append(level)
+        return levels
+
+    @staticmethod
+    def compute_tree(H: MerkleHash, data: list[bytes], size: Optional[int] = None):
+        """
+        Hash `data` into a flat tree with `size` leaves (default `len(data)`),
+        leaves past the end of `data` are the empty string.
+        """
+        l = len(data) if size is None else size
         if l & (l - 1) != 0:
             raise ValueError("data length must be a power of 2")
-        tree = [b""] * (2 * len(data) - 1)
-        for i in range(len(data)):
-            tree[i + len(data) - 1] = H.hash_leaf(data[i])
-        for i in range(len(data) - 2, -1, -1):
-            tree[i] = H.hash_node(tree[i * 2 + 1], tree[i * 2 + 2])
-        return tree
+        levels = MerkleTree.hash_levels(H, data, l)
+        # the heap order is just the levels from the root down
+        return bytearray().join(reversed(levels))
 
     @staticmethod
-    def from_data(H: MerkleHash, data: list[bytes]):
-        data = list(data)
+    def from_data(H: MerkleHash, data: list[bytes], keep_data: bool = True):
         l = len(data)
-        if l & (l - 1) != 0:
-            data.extend([b""] * (2 ** (l.bit_length()) - l))
-        tree = MerkleTree.compute_tree(H, data)
-        return MerkleTree(H, tree, data)
+        size = l if l & (l - 1) == 0 else 2 ** (l.bit_length())
+        tree = MerkleTree.compute_tree(H, data, size)
+        if not keep_data:
+            return MerkleTree(H, tree)
+        data = list(data) + [b""] * (size - l)
+        return MerkleTree(H, tree, data, verify_data=False)
+
+
+class IncrementalMerkleTree:
+    """
+    Append-only Merkle tree with the same shape, root and proofs as
+    MerkleTree.from_data over the same data.
+
+    Each append hashes only the nodes it completes, and finalize fills in the
+    right edge against all-padding subtrees, so both are O(log n).
+    """
+
+    def __init__(self, H: MerkleHash):
+        self.H = H
+        # levels[k] holds the nodes at height k back to back, only complete
+        # nodes until finalize
+        self.levels: list[bytearray] = [bytearray()]
+        self.views: list[memoryview] = []
+        # zeros[k] is the root of a padding-only subtree of height k
+        self.zeros = [H.hash_leaf(b"")]
+        self.lendata = 0
+        self.depth: Optional[int] = None
+
+    def append(self, x: bytes):
+        if self.depth is not None:
+            raise ValueError("tree is finalized")
+        s = self.H.size
+        self.levels[0] += self.H.hash_leaf(x)
+        self.lendata += 1
+        k = 0
+        while len(self.levels[k]) % (2 * s) == 0:
+            if k + 1 == len(self.levels):
+                self.levels.append(bytearray())
+            self.levels[k + 1] += self.H.hashfn(
+                b"\x01" + self.levels[k][-2 * s :]
+            ).digest()
+            k += 1
+
+    def finalize(self):
+        if self.depth is not None:
+            return
+        s = self.H.size
+        l = max(self.lendata, 1)
+        size = l if l & (l - 1) == 0 else 2 ** (l.bit_length())
+        depth = size.bit_length() - 1
+        while len(self.zeros) <= depth:
+            self.zeros.append(self.H.hash_node(self.zeros[-1], self.zeros[-1]))
+        while len(self.levels) <= depth:
+            self.levels.append(bytearray())
+        for k in range(depth):
+            level = self.levels[k]
+            if len(level) % (2 * s) != 0:
+                level += self.zeros[k]
+            if len(self.levels[k + 1]) < len(level) // 2:
+                self.levels[k + 1] += self.H.hashfn(b"\x01" + level[-2 * s :]).digest()
+        # the levels can't grow anymore, so it's safe to hand out views
+        self.views = [memoryview(level) for level in self.levels]
+        self.depth = depth
+
+    @property
+    def root(self):
+        if self.depth is None:
+            raise ValueError("tree is not finalized")
+        return bytes(self.views[self.depth][: self.H.size])
+
+    def node_at(self, k: int, j: int) -> Union[memoryview, bytes]:
+        # node j at height k, nodes past the end are padding
+        s = self.H.size
+        level = self.views[k]
+        if (j + 1) * s <= len(level):
+            return level[j * s : (j + 1) * s]
+        return self.zeros[k]
+
+    def get_proof(self, index: int) -> list[tuple[str, Union[memoryview, bytes]]]:
+        if self.depth is None:
+            raise ValueError("tree is not finalized")
+        ret = []
+        for k in range(self.depth):
+            j = (index >> k) ^ 1
+            ret.append(("L" if j % 2 == 0 else "R", self.node_at(k, j)))
+        return ret
+
+    def get_multiproof(self, indices: list[int]) -> bytes:
+        if self.depth is None:
+            raise ValueError("tree is not finalized")
+        siblings = multiproof_siblings(self.depth, indices, self.node_at)
+        return MULTIPROOF_PREFIX.pack(self.depth, len(siblings)) + b"".join(siblings)
 
 
 class MerkleTreeAccumulator(
@@ -111,11 +376,12 @@ class MerkleTreeAccumulator(
         self.H = H
 
     def accumulate(self, X: list[bytes]) -> MerkleTree:
-        mkt = MerkleTree.from_data(self.H, X)
+        # the caller keeps X, the tree doesn't need its own copy
+        mkt = MerkleTree.from_data(self.H, X, keep_data=False)
         return mkt
 
     def witgen(self, mkt: MerkleTree, X: list[bytes], index: int):
-        return mkt.get_proof(index)
+        return MerkleTree.detach_proof(mkt.get_proof(index))
 
     def verify(self, root: bytes, w: list[tuple[str, bytes]], x: bytes):
         return MerkleTree.check_proof(self.H, root, x, 0, w)
@@ -126,6 +392,33 @@ class MerkleTreeAccumulator(
     def get_bytes(self, root: bytes) -> bytes:
         return root
 
+    def witgen_many(self, mkt: MerkleTree, X: list[bytes], indices: list[int]):
+        # one multiproof for all the indices, see MerkleTree.get_multiproof
+        return mkt.get_multiproof(indices)
+
+    def verify_many(
+        self, root: bytes, w: bytes, indices: list[int], xs: list[bytes]
+    ) -> bool:
+        if len(indices) != len(xs):
+            raise ValueError("indices and xs must have the same length")
+        return MerkleTree.check_multiproof(self.H, root, w, list(zip(indices, xs)))
+
+    def pack_witness(self, w: list[tuple[str, bytes]]) -> bytes:
+        return MerkleTree.pack_proof(w)
+
+    def unpack_witness(self, data: bytes) -> list[tuple[str, bytes]]:
+        return MerkleTree.unpack_proof(self.H, data)
+
+    def init(self) -> IncrementalMerkleTree:
+        return IncrementalMerkleTree(self.H)
+
+    def update(self, mkt: IncrementalMerkleTree, x: bytes):
+        mkt.append(x)
+
+    def finalize(self, mkt: IncrementalMerkleTree) -> IncrementalMerkleTree:
+        mkt.finalize()
+        return mkt
+
 
 SortedMerkleTreeAccumulatorT = tuple[MerkleTree, list[int]]
 SortedMerkleTreeAccumulationValue = bytes
@@ -162,7 +455,7 @@ class SortedMerkleTreeAccumulator(
         self, acc: SortedMerkleTreeAccumulatorT, X: list[bytes], index: int
     ) -> SortedMerkleTreeWitness:
         mkt, index_map = acc
-        return mkt.get_proof(index_map[index])
+        return MerkleTree.detach_proof(mkt.get_proof(index_map[index]))
 
     def verify(self, root: bytes, w: list[tuple[str, bytes]], x: bytes) -> bool:
         return MerkleTree.check_proof(self.H, root, x, 0, w)
@@ -177,12 +470,16 @@ class SortedMerkleTreeAccumulator(
         index = bisect.bisect_left(mkt.data, x)  # index of sorted X
         # now X[index] > x
         left = (
-            (index - 1, mkt.data[index - 1], mkt.get_proof(index - 1))
+            (
+                index - 1,
+                mkt.data[index - 1],
+                MerkleTree.detach_proof(mkt.get_proof(index - 1)),
+            )
             if index > 0
             else None
         )
         right = (
-            (index, mkt.data[index], mkt.get_proof(index))
+            (index, mkt.data[index], MerkleTree.detach_proof(mkt.get_proof(index)))
             if index < len(mkt.data)
             else None
         )
@@ -269,5 +566,34 @@ if __name__ == "__main__":
         w3 = acc.nonmemwitgen(accm, X, b"6")
         assert acc.nonmemverify(accval, w3, b"6")
 
+    def test3():
+        for n in [1, 2, 3, 5, 8, 13, 64, 70]:
+            X = [int2bytes(i) for i in range(n)]
+            imt = IncrementalMerkleTree(H)
+            for x in X:
+                imt.append(x)
+            imt.finalize()
+            mkt = MerkleTree.from_data(H, X)
+            assert imt.root == mkt.root
+            for i in range(n):
+                assert imt.get_proof(i) == mkt.get_proof(i)
+
+    def test4():
+        acc = MerkleTreeAccumulator(H)
+        X = [int2bytes(i) for i in range(13)]
+        accm = acc.accumulate(X)
+        accval = acc.get_accval(accm)
+        for i, x in enumerate(X):
+            w = acc.unpack_witness(acc.pack_witness(acc.witgen(accm, X, i)))
+            assert acc.verify(accval, w, x)
+        for indices in [[0], [12], [3, 4, 5], [0, 7, 12], list(range(13))]:
+            w = acc.witgen_many(accm, X, indices)
+            xs = [X[i] for i in indices]
+            assert acc.verify_many(accval, w, indices, xs)
+            assert not acc.verify_many(accval, w, indices, [b"x"] + xs[1:])
+            assert not acc.verify_many(accval, w[:-1], indices, xs)
+
     test1()
     test2()
+    test3()
+    test4()
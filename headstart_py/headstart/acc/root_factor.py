@@ -0,0 +1,75 @@
+from concurrent.futures import Executor, as_completed
+from typing import Callable, Generator, Optional, TypeVar
+
+# RootFactor (Boneh-Bünz-Fisch section 3.3): all membership witnesses of X in
+# O(n log n) exponentiations instead of O(n^2). `exp(g, Y)` must return g raised
+# to every element of Y.
+
+G = TypeVar("G")
+T = TypeVar("T")
+
+
+def root_factor_serial(
+    exp: Callable[[G, list[T]], G], g: G, X: list[T], offset: int = 0
+) -> Generator[tuple[int, G], None, None]:
+    if len(X) == 1:
+        yield offset, g
+        return
+    h = len(X) // 2
+    gl = exp(g, X[:h])
+    gr = exp(g, X[h:])
+    yield from root_factor_serial(exp, gr, X[:h], offset)
+    yield from root_factor_serial(exp, gl, X[h:], offset + h)
+
+
+def root_factor_task(
+    exp: Callable[[G, list[T]], G], g: G, X: list[T], offset: int
+) -> list[tuple[int, G]]:
+    return list(root_factor_serial(exp, g, X, offset))
+
+
+def root_factor(
+    exp: Callable[[G, list[T]], G],
+    g: G,
+    X: list[T],
+    executor: Optional[Executor] = None,
+    tasks: int = 32,
+    serial_cutoff: int = 16,
+) -> Generator[tuple[int, G], None, None]:
+    """
+    Yield `(index, witness)` for every element of X, in no particular order.
+
+    With an executor, the top levels of the recursion are expanded one level at
+    a time with all their exponentiations submitted at once, until there are
+    `tasks` subtrees or the subtrees have at most `serial_cutoff` elements.
+    The subtrees then run serially on the executor, and their witnesses are
+    yielded as each one finishes. `exp` and the group elements must be
+    picklable for a process pool.
+    """
+    if not X:
+        return
+    if executor is None or len(X) <= serial_cutoff:
+        yield from root_factor_serial(exp, g, X)
+        return
+    nodes = [(0, g, X)]
+    while len(nodes) < tasks and all(len(Y) > serial_cutoff for _, _, Y in nodes):
+        futures = []
+        for offset, base, Y in nodes:
+            h = len(Y) // 2
+            # the left half's witnesses all include the right half and vice versa
+            futures.append((offset, Y[:h], executor.submit(exp, base, Y[h:])))
+            futures.append((offset + h, Y[h:], executor.submit(exp, base, Y[:h])))
+        nodes = [(offset, f.result(), Y) for offset, Y, f in futures]
+    subtrees = [
+        executor.submit(root_factor_task, exp, base, Y, offset)
+        for offset, base, Y in nodes
+    ]
+    for f in as_completed(subtrees):
+        yield from f.result()
+
+
+def collect(witnesses: Generator[tuple[int, G], None, None], n: int) -> list[G]:
+    ret: list = [None] * n
+    for i, w in witnesses:
+        ret[i] = w
+    return ret
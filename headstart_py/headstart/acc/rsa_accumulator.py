@@ -1,51 +1,144 @@
 from Crypto.Util.number import getPrime, bytes_to_long, long_to_bytes
 import gmpy2, math
-from headstart.utils import H_P
+from headstart.utils import H_P_cached, H_P_many
 from headstart.abstract import AbstractAccumulator, AbstractUniversalAccumulator
+from headstart.acc.witness_cache import WitnessCache
+from headstart.acc.root_factor import root_factor, collect
+from headstart.acc.batch_verify import bisect_verify, random_exponents
+from concurrent.futures import Executor
+from threading import Lock
+from typing import Generator, Optional
+
+
+def multi_powmod(bases: list, exps: list, n) -> gmpy2.mpz:
+    """
+    prod(b_i^e_i) mod n with Pippenger's bucket method: every window of c bits
+    costs one multiplication per base plus 2^(c + 1), and the squarings are
+    shared between all the bases.
+    """
+    bits = max((int(e).bit_length() for e in exps), default=0)
+    c = max(2, min(10, len(bases).bit_length() - 3))
+    mask = (1 << c) - 1
+    r = gmpy2.mpz(1)
+    for shift in range((bits + c - 1) // c * c - c, -1, -c):
+        for _ in range(c):
+            r = r * r % n
+        buckets: list = [None] * (mask + 1)
+        for b, e in zip(bases, exps):
+            d = (e >> shift) & mask
+            if d:
+                buckets[d] = b if buckets[d] is None else buckets[d] * b % n
+        # sum of d * buckets[d], as a running product from the top bucket down
+        running = total = None
+        for d in range(mask, 0, -1):
+            if buckets[d] is not None:
+                running = buckets[d] if running is None else running * buckets[d] % n
+            if running is not None:
+                total = running if total is None else total * running % n
+        if total is not None:
+            r = r * total % n
+    return r
 
 
 class RSAAccumulator(AbstractAccumulator[int, int, int]):
-    def __init__(self, n: int, g: int):
+    def __init__(
+        self,
+        n: int,
+        g: int,
+        executor: Optional[Executor] = None,
+        exponent_chunk: int = 64,
+    ):
         self.n = gmpy2.mpz(n)
         self.g = gmpy2.mpz(g)
-        self.witness_cache = {}
+        # exponents are multiplied together in chunks of this many before a
+        # powmod, bounding the size of each exponent
+        self.exponent_chunk = exponent_chunk
+        self.witness_cache = WitnessCache()
+        # batch_witgen runs on this if given, see headstart.acc.root_factor
+        self.executor = executor
+
+    def __getstate__(self):
+        # the cache and the executor stay in this process, e.g. when the
+        # accumulator is sent to the executor's workers
+        state = self.__dict__.copy()
+        del state["witness_cache"], state["executor"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.witness_cache = WitnessCache()
+        self.executor = None
 
     def bytes_to_long(self, x):
         return int.from_bytes(x, "big")
 
+    def exponents(self, X: list[bytes]) -> list[gmpy2.mpz]:
+        return [gmpy2.mpz(self.bytes_to_long(x)) for x in X]
+
+    def powmod_all(self, g, E: list[gmpy2.mpz]):
+        # g raised to every exponent in E, with one powmod per chunk of
+        # exponents instead of one per exponent
+        for i in range(0, len(E), self.exponent_chunk):
+            g = gmpy2.powmod(g, math.prod(E[i : i + self.exponent_chunk]), self.n)
+        return g
+
     def accumulate(self, X: list[bytes]) -> int:
-        r = self.g
-        for x in X:
-            r = gmpy2.powmod(r, self.bytes_to_long(x), self.n)
-        return int(r)
+        return int(self.powmod_all(self.g, self.exponents(X)))
+
+    def exp(self, g, X: list[bytes]):
+        return self.powmod_all(g, self.exponents(X))
+
+    def iter_witgen(self, X: list[bytes]) -> Generator[tuple[int, int], None, None]:
+        # (index, witness) pairs as they are computed. The elements are turned
+        # into exponents once, not again at every level of the recursion.
+        return root_factor(self.powmod_all, self.g, self.exponents(X), self.executor)
 
     def batch_witgen(self, X: list[bytes]) -> list[int]:
-        def root_factor(g, X):
-            if len(X) == 1:
-                return [g]
-            h = len(X) // 2
-            gl = g
-            for x in X[:h]:
-                gl = gmpy2.powmod(gl, self.bytes_to_long(x), self.n)
-            gr = g
-            for x in X[h:]:
-                gr = gmpy2.powmod(gr, self.bytes_to_long(x), self.n)
-            L = root_factor(gr, X[:h])
-            R = root_factor(gl, X[h:])
-            return L + R
-
-        return root_factor(self.g, X)
+        return collect(self.iter_witgen(X), len(X))
+
+    def witnesses(self, acc: int, X: list[bytes]) -> list[int]:
+        return self.witness_cache.get(
+            self.get_bytes(acc),
+            X,
+            lambda: self.batch_witgen(X),
+            len(X) * ((self.n.bit_length() + 7) // 8),
+        )
 
     def witgen(self, acc: int, X: list[bytes], index: int) -> int:
-        cache_key = hash(tuple(X))
-        if cache_key not in self.witness_cache:
-            self.witness_cache[cache_key] = self.batch_witgen(X)
-        witness_cache = self.witness_cache[cache_key]
-        return witness_cache[index]
+        return self.witnesses(acc, X)[index]
+
+    def prepare(self, acc: int, X: list[bytes]):
+        self.witnesses(acc, X)
 
     def verify(self, acc: int, w: int, x: bytes) -> bool:
         return gmpy2.powmod(w, self.bytes_to_long(x), self.n) == acc
 
+    def verify_up_to_sign(self, acc: int, w: int, x: bytes) -> bool:
+        # w^x == +-acc, what check_batch tests for a single item
+        r = gmpy2.powmod(w, self.bytes_to_long(x), self.n)
+        return r == acc or r == self.n - acc
+
+    def check_batch(self, acc: int, items: list[tuple[int, bytes]]) -> bool:
+        rs = random_exponents(len(items))
+        E = self.exponents([x for _, x in items])
+        lhs = multi_powmod(
+            [gmpy2.mpz(w) for w, _ in items], [e * r for e, r in zip(E, rs)], self.n
+        )
+        return lhs * lhs % self.n == gmpy2.powmod(acc, 2 * sum(rs), self.n)
+
+    def verify_batch(self, acc: int, items: list[tuple[int, bytes]]) -> list[bool]:
+        # Membership up to sign: an item passes iff w^x == +-acc. -1 has order
+        # 2, so a random-exponent batch can't tell w^x == -acc apart from acc
+        # (it would pass half the time). check_batch squares the batched
+        # product once to cancel the sign, and single items are checked with
+        # verify_up_to_sign, so the result doesn't depend on the batching.
+        # verify itself stays exact.
+        return bisect_verify(
+            items,
+            lambda batch: self.check_batch(acc, batch),
+            lambda item: self.verify_up_to_sign(acc, *item),
+        )
+
     def get_accval(self, acc: int) -> int:
         return acc
 
@@ -53,6 +146,14 @@ class RSAAccumulator(AbstractAccumulator[int, int, int]):
         bl = (self.n.bit_length() + 7) // 8
         return acc.to_bytes(bl, "big")
 
+    def pack_witness(self, w: int) -> bytes:
+        return self.get_bytes(w)
+
+    def unpack_witness(self, data: bytes) -> int:
+        if len(data) != (self.n.bit_length() + 7) // 8:
+            raise ValueError("invalid witness")
+        return gmpy2.mpz(int.from_bytes(data, "big"))
+
     @classmethod
     def generate(cls, bits):
         # require trusted setup :(
@@ -63,16 +164,84 @@ class RSAAccumulator(AbstractAccumulator[int, int, int]):
         return cls(n, g)
 
 
+def product(E: list[gmpy2.mpz]) -> gmpy2.mpz:
+    # product tree, multiplying numbers of similar sizes is much cheaper than
+    # multiplying into one growing product
+    E = list(E) or [gmpy2.mpz(1)]
+    while len(E) > 1:
+        E = [E[i] * E[i + 1] if i + 1 < len(E) else E[i] for i in range(0, len(E), 2)]
+    return E[0]
+
+
 class RSAPrimeAccumulator(
     RSAAccumulator, AbstractUniversalAccumulator[int, int, int, tuple[int, int]]
 ):
+    def __init__(self, *args, fixed_base_bytes: int = 1 << 26, **kwargs):
+        super().__init__(*args, **kwargs)
+        # products of the accumulated primes, keyed like the witnesses
+        self.product_cache = WitnessCache(size=4)
+        # g_table[i] = g^(2^(8i)), grown on demand up to fixed_base_bytes
+        self.fixed_base_bytes = fixed_base_bytes
+        self.g_table = [self.g]
+        # pow_g runs concurrently, e.g. on the executor's threads
+        self.g_table_lock = Lock()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state["product_cache"], state["g_table"], state["g_table_lock"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.product_cache = WitnessCache(size=4)
+        self.g_table = [self.g]
+        self.g_table_lock = Lock()
+
+    def pow_g(self, e):
+        """
+        g^e for large exponents, using a fixed-base table of g^(2^(8i)) and Yao's
+        method: one multiplication per byte of e plus 2 * 255, instead of a
+        squaring per bit. Falls back to powmod if the table would be too big.
+        """
+        if e < 0:
+            return gmpy2.invert(self.pow_g(-e), self.n)
+        digits = gmpy2.mpz(e).to_bytes((e.bit_length() + 7) // 8, "little")
+        if len(digits) * ((self.n.bit_length() + 7) // 8) > self.fixed_base_bytes:
+            return gmpy2.powmod(self.g, e, self.n)
+        with self.g_table_lock:
+            while len(self.g_table) < len(digits):
+                self.g_table.append(gmpy2.powmod(self.g_table[-1], 256, self.n))
+            table = self.g_table
+        buckets: list[list[int]] = [[] for _ in range(256)]
+        for i, d in enumerate(digits):
+            buckets[d].append(i)
+        # sum over d of d * (sum of the exponents with digit d)
+        r = acc = gmpy2.mpz(1)
+        for d in range(255, 0, -1):
+            for i in buckets[d]:
+                acc = acc * table[i] % self.n
+            r = r * acc % self.n
+        return r
+
     def bytes_to_long(self, x):
-        return H_P(x, 256)
+        return H_P_cached(x, 256)
+
+    def exponents(self, X: list[bytes]) -> list[gmpy2.mpz]:
+        return [gmpy2.mpz(p) for p in H_P_many(X, 256)]
 
     def nonmemwitgen(self, acc: int, X: list[bytes], x: bytes) -> tuple[int, int]:
-        s = math.prod(self.bytes_to_long(x) for x in X)
-        _, a, b = gmpy2.gcdext(s, self.bytes_to_long(x))
-        B = gmpy2.powmod(self.g, b, self.n)
+        s = self.product_cache.get(
+            self.get_bytes(acc),
+            X,
+            lambda: product(self.exponents(X)),
+            len(X) * 256 // 8,
+        )
+        p = self.bytes_to_long(x)
+        # a * s + b * p = 1, with the gcd taken against s mod p rather than s
+        q, r = gmpy2.f_divmod(s, p)
+        _, a, t = gmpy2.gcdext(r, p)
+        b = t - a * q
+        B = self.pow_g(b)
         return a, B
 
     def nonmemverify(self, acc: int, w: tuple[int, int], x: bytes) -> bool:
@@ -98,6 +267,22 @@ if __name__ == "__main__":
     for x, w in zip(X, ww):
         assert acc.verify(accval, w, x)
 
+    def test_verify_batch(acc):
+        X = [b"peko%d" % i for i in range(16)]
+        accval = acc.get_accval(acc.accumulate(X))
+        items = list(zip(acc.batch_witgen(X), X))
+        assert acc.verify_batch(accval, items) == [True] * len(X)
+        # a witness for another element, and a negated one, w^x == -acc for
+        # odd x, that only verify_batch accepts
+        items[5] = (items[6][0], X[5])
+        items[9] = (acc.n - items[9][0], X[9])
+        expected = [i != 5 for i in range(len(X))]
+        for _ in range(8):
+            assert acc.verify_batch(accval, items) == expected
+        assert acc.verify(accval, *items[9]) == (acc.bytes_to_long(X[9]) % 2 == 0)
+
+    test_verify_batch(acc)
+
     acc2 = RSAPrimeAccumulator.generate(1024)
     X = [b"peko", b"peko2", b"peko3"]
     accm = acc2.accumulate(X)
@@ -109,3 +294,4 @@ if __name__ == "__main__":
     assert acc2.nonmemverify(accval, w, b"peko4")
     w = acc2.nonmemwitgen(accm, X, X[0])
     assert not acc2.nonmemverify(accval, w, X[0])
+    test_verify_batch(acc2)
@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from threading import Lock, Event
+from typing import Callable
+
+
+class WitnessCache:
+    """
+    Witnesses of recently accumulated sets, keyed by the accumulator value.
+
+    Each entry remembers the list it was computed for, and only serves the same
+    list (or an equal one, which is only compared when the list object differs),
+    so a reordered set with the same value never gets the wrong witnesses.
+    Entries are evicted least recently used first once there are more than
+    `size` of them or they take more than `max_bytes`. Concurrent lookups of the
+    same key compute the witnesses once.
+    """
+
+    def __init__(self, size: int = 16, max_bytes: int = 1 << 28):
+        self.size = size
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries: OrderedDict[bytes, tuple[list[bytes], list, int]] = OrderedDict()
+        self.inflight: dict[bytes, Event] = {}
+        self.lock = Lock()
+
+    def remember(self, key: bytes, X: list[bytes], witnesses: list, nbytes: int):
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[2]
+        if nbytes > self.max_bytes:
+            # wouldn't fit even on its own, don't flush the cache for it
+            return
+        self.entries[key] = (X, witnesses, nbytes)
+        self.nbytes += nbytes
+        while len(self.entries) > self.size or self.nbytes > self.max_bytes:
+            self.nbytes -= self.entries.popitem(last=False)[1][2]
+
+    def get(
+        self, key: bytes, X: list[bytes], compute: Callable[[], list], nbytes: int
+    ) -> list:
+        # the witnesses of X, computed with `compute` (taking about `nbytes`)
+        # unless they are cached
+        while True:
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and (entry[0] is X or entry[0] == X):
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                event = self.inflight.get(key)
+                if event is None:
+                    event = self.inflight[key] = Event()
+                    break
+            # someone else is computing witnesses for this value, use theirs
+            event.wait()
+        try:
+            witnesses = compute()
+            with self.lock:
+                self.remember(key, X, witnesses, nbytes)
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            event.set()
+        return witnesses
@@ -0,0 +1,450 @@
+from apscheduler.schedulers.background import BackgroundScheduler
+from threading import Lock, Condition
+from collections import OrderedDict
+import atexit, logging
+from typing import Optional
+from headstart.stage import (
+    Stage,
+    Phase,
+    Parameters,
+    batch_receipt_message,
+    checkpoint_windows,
+)
+from headstart.scheduler import VDFScheduler
+from headstart.storage import StageStore, StageLog
+import headstart.public_key as public_key
+import headstart.wire as wire
+
+
+class RandomnessBeacon:
+    def __init__(
+        self,
+        logger: logging.Logger,
+        priv_key: public_key.Ed25519PrivateKey,
+        store: StageStore,
+        log: Optional[StageLog] = None,
+    ):
+        self.logger = logger
+        # only the last few stages are kept in memory, older ones live in `store`
+        self.stages: list[Stage] = [Stage()]
+        self.first_stage_index = 0
+        self.store = store
+        self.log = log
+        # guards `stages` and `first_stage_index` against concurrent eviction
+        self.stages_lock = Lock()
+        # notified whenever a stage changes phase, for long-polling waiters
+        self.phase_changed = Condition()
+        self.interval_seconds = 3
+        self.W = Parameters.W
+        self.priv_key = priv_key
+        self.vdf_scheduler = VDFScheduler(
+            logger,
+            max_pending=self.W,
+            on_evaluated=self.stage_evaluated,
+            on_aggregated=self.stage_aggregated,
+        )
+        # number of times closing a stage was deferred due to back-pressure
+        self.deferred = 0
+        # serialized records of finished stages, see stage_range
+        self.record_cache: OrderedDict[int, bytes] = OrderedDict()
+        self.record_cache_size = 4096
+        self.record_lock = Lock()
+        self.wire_sizes: Optional[tuple[int, int, int]] = None
+        # number of evictions since the log segment was started
+        self.evicted_in_segment = 0
+        if self.log is not None:
+            self.recover()
+
+    @property
+    def current_stage(self):
+        return self.stages[-1]
+
+    @property
+    def current_stage_index(self):
+        return self.first_stage_index + len(self.stages) - 1
+
+    def get_stage(self, stage_idx: int):
+        if not (0 <= stage_idx <= self.current_stage_index):
+            raise ValueError("invalid stage")
+        with self.stages_lock:
+            if stage_idx >= self.first_stage_index:
+                return self.stages[stage_idx - self.first_stage_index]
+        return self.store.get(stage_idx)
+
+    def evict_stages(self):
+        # move finished stages that are outside of the hot window to the store
+        while len(self.stages) > self.W and self.stages[0].phase >= Phase.DONE:
+            self.store.put(self.first_stage_index, self.stages[0])
+            with self.stages_lock:
+                self.stages.pop(0)
+                self.first_stage_index += 1
+                if self.log is not None:
+                    self.log.append(["evict", self.first_stage_index - 1])
+            self.evicted_in_segment += 1
+        if self.log is not None and self.evicted_in_segment >= self.W:
+            self.rotate_log()
+
+    def snapshot(self) -> list[list]:
+        # log records that recreate the in-memory stages
+        return [
+            [
+                "stage",
+                stage.index,
+                stage.phase.value,
+                stage.data,
+                stage.vdf_challenge if stage.y_ready.is_set() else None,
+                stage.vdf_y if stage.y_ready.is_set() else None,
+                stage.vdf_proof if stage.done.is_set() else None,
+            ]
+            for stage in self.stages
+        ]
+
+    def rotate_log(self):
+        with self.stages_lock:
+            self.log.rotate(self.first_stage_index, self.snapshot)
+            self.evicted_in_segment = 0
+
+    def recover(self):
+        state = self.log.replay()
+        if state is not None and state[1]:
+            first, stages = state
+            self.first_stage_index = first
+            self.stages = []
+            for idx in sorted(stages):
+                st = stages[idx]
+                prev_stages = [
+                    self.get_stage(j) for j in range(max(idx - self.W + 1, 0), idx)
+                ]
+                self.stages.append(
+                    Stage.restore(
+                        prev_stages,
+                        idx,
+                        st["data"],
+                        st["phase"],
+                        st["vdfchallenge"],
+                        st["vdfy"],
+                        st["vdfproof"],
+                    )
+                )
+            self.logger.info(
+                f"Recovered stages #{first} to #{self.current_stage_index} from the log"
+            )
+            if self.current_stage.phase != Phase.CONTRIBUTION:
+                self.stages.append(
+                    Stage(self.stages[-self.W + 1 :], self.current_stage_index + 1)
+                )
+            # resume the VDF work that was in flight, in chain order. The last
+            # checkpoint of a stage is its logged y: a stage whose y survived
+            # is only aggregated again, the others are evaluated from the start
+            # since chiavdf does not expose intermediate squaring states
+            for stage in self.stages:
+                if stage.phase == Phase.EVALUATION:
+                    self.vdf_scheduler.submit(stage)
+                if stage.phase >= Phase.EVALUATION:
+                    self.prepare_stage(stage)
+        self.rotate_log()
+
+    def stage_evaluated(self, stage: Stage):
+        if self.log is not None:
+            self.log.append(
+                ["evaluated", stage.index, stage.vdf_challenge, stage.vdf_y]
+            )
+
+    def stage_aggregated(self, stage: Stage):
+        if self.log is not None:
+            self.log.append(["done", stage.index, stage.vdf_proof])
+        self.notify_phase_changed()
+        for start, end in checkpoint_windows(stage.index, stage.index):
+            self.vdf_scheduler.checkpoint_pool.submit(self.prove_checkpoint, start, end)
+
+    def prepare_stage(self, stage: Stage):
+        # witness precomputation shares the aggregation workers
+        if stage.needs_prepare():
+            self.vdf_scheduler.aggregate_pool.submit(self.prepare_witnesses, stage)
+
+    def prepare_witnesses(self, stage: Stage):
+        try:
+            stage.prepare()
+        except Exception:
+            self.logger.exception(f"Preparing witnesses of stage #{stage.index} failed")
+
+    def prove_checkpoint(self, start: int, end: int):
+        # aggregated proof over the long window [start, end], see checkpoint_windows
+        try:
+            stages = [self.get_stage(idx) for idx in range(start, end + 1)]
+            proof = Parameters.avdf.aggregate(
+                [stage.vdf_challenge for stage in stages],
+                [stage.vdf_y for stage in stages],
+            )
+            self.store.put_checkpoint(start, end, proof)
+        except Exception:
+            self.logger.exception(f"Checkpoint proof for [{start}, {end}] failed")
+
+    def checkpoints(self, start: int, end: int) -> list[dict]:
+        # published checkpoint proofs whose last stage is in [start, end]
+        ret = []
+        for st, ed in checkpoint_windows(start, min(end, self.current_stage_index)):
+            proof = self.store.get_checkpoint(st, ed)
+            if proof is not None:
+                ret.append({"start": st, "end": ed, "proof": proof})
+        return ret
+
+    def notify_phase_changed(self):
+        with self.phase_changed:
+            self.phase_changed.notify_all()
+
+    def finalized_index(self) -> int:
+        # the last stage that is finished along with all stages before it
+        with self.stages_lock:
+            idx = self.first_stage_index
+            for stage in self.stages:
+                if stage.phase < Phase.DONE:
+                    break
+                idx += 1
+        return idx - 1
+
+    def stage_phase(self, idx: int) -> Phase:
+        if idx > self.current_stage_index:
+            return Phase.NONE
+        return self.get_stage(idx).phase
+
+    def wait_stage(self, idx: int, phase: str, timeout: float) -> dict:
+        # block until stage `idx` reaches `phase` or `timeout` seconds passed,
+        # then return its info either way
+        if idx >= 0:
+            with self.phase_changed:
+                self.phase_changed.wait_for(
+                    lambda: self.stage_phase(idx) >= Phase[phase], timeout
+                )
+        return self.stage_info(idx)
+
+    def get_stage_after_phase(self, stage_idx: int, phase: Phase):
+        stage = self.get_stage(stage_idx)
+        if stage.phase < phase:
+            raise ValueError("not in correct phase")
+        return stage
+
+    def contribute(self, x: bytes):
+        return self.contribute_many([x])[0]
+
+    def append_contributions(self, xs: list[bytes]) -> tuple[int, list[int]]:
+        # append `xs` to the current stage contiguously and durably
+        self.logger.debug(
+            f"Contributions received",
+            extra={"count": len(xs), "stage": self.current_stage_index},
+        )
+        with self.stages_lock:
+            stage_idx = self.current_stage_index
+            data_idxs = [self.current_stage.contribute(x) for x in xs]
+            if self.log is not None:
+                for x in xs:
+                    seq = self.log.append(["contribute", stage_idx, x])
+        if self.log is not None and xs:
+            # never hand out a receipt for a contribution that could be lost
+            self.log.wait(seq)
+        return stage_idx, data_idxs
+
+    def contribute_many(self, xs: list[bytes]) -> list[tuple[int, int, bytes]]:
+        stage_idx, data_idxs = self.append_contributions(xs)
+        return [
+            (stage_idx, data_idx, public_key.sign(self.priv_key, x))
+            for data_idx, x in zip(data_idxs, xs)
+        ]
+
+    def contribute_batch(self, xs: list[bytes]) -> tuple[int, int, bytes]:
+        # one signature over the Merkle root of the whole batch
+        if not xs:
+            raise ValueError("empty batch")
+        stage_idx, data_idxs = self.append_contributions(xs)
+        message = batch_receipt_message(stage_idx, data_idxs[0], xs)
+        return stage_idx, data_idxs[0], public_key.sign(self.priv_key, message)
+
+    def config(self) -> dict:
+        return {
+            "interval_seconds": self.interval_seconds,
+            "window_size": self.W,
+            "checkpoint_levels": Parameters.checkpoint_levels,
+        }
+
+    def info(self) -> dict:
+        stage = self.current_stage
+        return {
+            "stage": self.current_stage_index,
+            "phase": stage.phase.name,
+            "contributions": stage.contributions,
+            **self.metrics(),
+        }
+
+    def stage_info(self, idx: int) -> dict:
+        if idx == -1:
+            # for client implementation convenience
+            return {
+                "stage": -1,
+                "phase": "DONE",
+                "contributions": 0,
+                "vdfy": b"",
+                "accval": b"",
+                "vdfchallenge": b"",
+                "vdfproof": b"",
+                "randomness": b"",
+            }
+        try:
+            stage = self.get_stage(idx)
+        except ValueError:
+            return {"stage": idx, "phase": "NONE", "contributions": 0}
+        ret = {
+            "stage": idx,
+            "phase": stage.phase.name,
+            "contributions": stage.contributions,
+        }
+        if stage.phase >= Phase.EVALUATION:
+            ret["accval"] = stage.get_acc_val()
+        if stage.phase >= Phase.DONE:
+            ret["vdfy"] = stage.get_final_y()
+            ret["vdfproof"] = stage.get_vdf_proof()
+        return ret
+
+    def stage_infos(self, start: int, end: Optional[int] = None) -> list[dict]:
+        # inclusive, `end` defaults to the current stage
+        if end is None:
+            end = self.current_stage_index
+        return [self.stage_info(idx) for idx in range(start, end + 1)]
+
+    def get_wire_sizes(self) -> Optional[tuple[int, int, int]]:
+        # (accval, y, proof) sizes, known once some stage is finished
+        if self.wire_sizes is None:
+            for stage in self.stages:
+                if stage.phase >= Phase.DONE:
+                    self.wire_sizes = (
+                        len(stage.get_acc_val()),
+                        len(stage.get_final_y()),
+                        len(stage.get_vdf_proof()),
+                    )
+                    break
+            else:
+                if self.first_stage_index > 0:
+                    stage = self.store.get(0)
+                    self.wire_sizes = (
+                        len(stage.get_acc_val()),
+                        len(stage.get_final_y()),
+                        len(stage.get_vdf_proof()),
+                    )
+        return self.wire_sizes
+
+    def stage_record(self, idx: int, sizes: tuple[int, int, int]) -> bytes:
+        with self.record_lock:
+            if idx in self.record_cache:
+                self.record_cache.move_to_end(idx)
+                return self.record_cache[idx]
+        try:
+            stage = self.get_stage(idx)
+        except ValueError:
+            return wire.pack_record(idx, Phase.NONE, 0, None, None, *sizes[:2])
+        phase = stage.phase
+        record = wire.pack_record(
+            idx,
+            phase,
+            stage.contributions,
+            stage.get_acc_val() if phase >= Phase.EVALUATION else None,
+            stage.get_final_y() if phase >= Phase.DONE else None,
+            *sizes[:2],
+        )
+        if phase >= Phase.DONE:
+            # finished stages never change, serialize them only once
+            with self.record_lock:
+                self.record_cache[idx] = record
+                while len(self.record_cache) > self.record_cache_size:
+                    self.record_cache.popitem(last=False)
+        return record
+
+    def stage_range(
+        self, start: int, end: Optional[int] = None, proofs: Optional[list[int]] = None
+    ) -> bytes:
+        """
+        Stages [start, end] in the binary format of headstart.wire. `proofs` lists
+        the stages whose proof should be included, None means one per window
+        counting back from `end`. Indices outside of [start, end] are ignored.
+        """
+        start = max(start, 0)
+        if end is None:
+            end = self.current_stage_index
+        if proofs is None:
+            proofs = range(end, start - 1, -self.W)
+        proofs = sorted({idx for idx in proofs if start <= idx <= end})
+        # one proof per window is enough to verify the whole range
+        if len(proofs) > -(-(end - start + 1) // self.W):
+            raise ValueError("too many proofs requested")
+        sizes = self.get_wire_sizes()
+        if sizes is None:
+            acc = Parameters.accumulator
+            sizes = (len(acc.get_accval(acc.accumulate([b""]))), 0, 0)
+        records = [self.stage_record(idx, sizes) for idx in range(start, end + 1)]
+        proof_list = []
+        for idx in proofs:
+            try:
+                stage = self.get_stage(idx)
+            except ValueError:
+                continue
+            if stage.phase >= Phase.DONE:
+                proof_list.append((idx, stage.get_vdf_proof()))
+        return wire.pack_range(start, records, proof_list, *sizes)
+
+    def acc_proof(self, stage_idx: int, data_idx: int, compact: bool = False):
+        stage = self.get_stage_after_phase(stage_idx, Phase.EVALUATION)
+        if not 0 <= data_idx < stage.contributions:
+            raise ValueError("invalid data index")
+        proof = stage.get_acc_proof(data_idx)
+        if compact:
+            return Parameters.accumulator.pack_witness(proof)
+        return proof
+
+    def acc_multiproof(self, stage_idx: int, data_indices: list[int]) -> bytes:
+        stage = self.get_stage_after_phase(stage_idx, Phase.EVALUATION)
+        if not all(0 <= i < stage.contributions for i in data_indices):
+            raise ValueError("invalid data index")
+        return stage.get_acc_multiproof(data_indices)
+
+    def metrics(self):
+        lag = 0.0
+        for stage in reversed(self.stages):
+            if stage.closed_at is not None:
+                lag = stage.chain_lag()
+                break
+        return {
+            "chain_lag": lag,
+            "deferred": self.deferred,
+            **self.vdf_scheduler.metrics(),
+        }
+
+    def next_stage(self):
+        if not self.vdf_scheduler.admit():
+            # the VDF pipeline is behind, keep the current stage open one
+            # more interval rather than queueing unbounded work
+            self.deferred += 1
+            self.logger.warning(
+                f"VDF pipeline is behind, extending stage #{self.current_stage_index}"
+            )
+            return
+        self.logger.info(f"Starting next stage #{self.current_stage_index + 1}")
+        with self.stages_lock:
+            stage = self.current_stage
+            stage.close()
+            prev_stages = self.stages[-self.W + 1 :]
+            self.stages.append(Stage(prev_stages, self.current_stage_index + 1))
+            if self.log is not None:
+                self.log.append(["close", stage.index])
+                self.log.append(["begin", stage.index + 1])
+        self.notify_phase_changed()
+        self.vdf_scheduler.submit(stage)
+        self.prepare_stage(stage)
+        self.evict_stages()
+
+    def register_scheduler(self):
+        scheduler = BackgroundScheduler()
+        scheduler.add_job(
+            func=self.next_stage, trigger="interval", seconds=self.interval_seconds
+        )
+        scheduler.start()
+        atexit.register(lambda: scheduler.shutdown())
+        atexit.register(self.vdf_scheduler.shutdown)
+        self.scheduler = scheduler
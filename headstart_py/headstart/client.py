@@ -1,8 +1,24 @@
-from headstart.stage import Parameters, Phase, Stage
+from headstart.stage import Parameters, Phase, Stage, batch_receipt_message
 from dataclasses import dataclass
-import httpx, base64, msgpack, time, headstart.public_key as public_key
+from collections import OrderedDict
+from hashlib import sha256
+from threading import Lock, Event
+import headstart.wire as wire
+import httpx, base64, msgpack, time, asyncio, os, heapq, headstart.public_key as public_key
 from cryptography.hazmat.primitives import serialization
-from typing import Optional
+from typing import Callable, Optional
+
+
+@dataclass
+class BatchReceipt:
+    # one signature over a whole batch, see headstart.stage.batch_receipt_message
+    stage: int
+    data_index: int
+    values: list[bytes]
+    signature: bytes
+
+    def message(self) -> bytes:
+        return batch_receipt_message(self.stage, self.data_index, self.values)
 
 
 @dataclass
@@ -10,7 +26,49 @@ class Contribution:
     value: bytes
     stage: int
     data_index: int
-    signature: bytes
+    # a single contribution is signed on its own, one sent in a batch carries
+    # the receipt of its batch instead
+    signature: Optional[bytes] = None
+    receipt: Optional[BatchReceipt] = None
+
+
+def verify_receipt(pub_key: public_key.Ed25519PublicKey, ct: Contribution) -> bool:
+    if ct.receipt is None:
+        return ct.signature is not None and public_key.verify(
+            pub_key, ct.value, ct.signature
+        )
+    r = ct.receipt
+    i = ct.data_index - r.data_index
+    return (
+        ct.stage == r.stage
+        and 0 <= i < len(r.values)
+        and r.values[i] == ct.value
+        and public_key.verify(pub_key, r.message(), r.signature)
+    )
+
+
+def batch_contributions(
+    pub_key: public_key.Ed25519PublicKey, randomness: list[bytes], res: dict
+) -> list[Contribution]:
+    # the contributions of a /api/contribute_batch response
+    if "error" in res:
+        raise ValueError(res["error"])
+    if res["count"] != len(randomness):
+        raise ValueError("invalid batch receipt")
+    receipt = BatchReceipt(
+        res["stage"], res["data_index"], randomness, res["signature"]
+    )
+    if not public_key.verify(pub_key, receipt.message(), receipt.signature):
+        raise ValueError("invalid signature")
+    return [
+        Contribution(
+            value=x,
+            stage=receipt.stage,
+            data_index=receipt.data_index + i,
+            receipt=receipt,
+        )
+        for i, x in enumerate(randomness)
+    ]
 
 
 @dataclass
@@ -28,6 +86,232 @@ class StageInfo:
             self.phase = Phase[self.phase]
 
 
+class VerifiedWindowCache:
+    """
+    Remembers which aggregated VDF windows have been verified successfully.
+
+    Keys are (start, end, digest), where the digest covers the proof together
+    with the challenges and ys it was checked against, so a cached entry can
+    never vouch for different values. Concurrent verifications of the same
+    window run once and share the result. Only successes are cached; when
+    `path` is given they are also appended there and reloaded on startup.
+    """
+
+    def __init__(self, size: int = 4096, path: Optional[str] = None):
+        self.size = size
+        self.entries: OrderedDict[tuple[int, int, bytes], None] = OrderedDict()
+        self.inflight: dict[tuple[int, int, bytes], Event] = {}
+        self.lock = Lock()
+        self.file = None
+        if path is not None:
+            if os.path.exists(path):
+                with open(path) as f:
+                    for line in f:
+                        start, end, digest = line.split()
+                        self.remember((int(start), int(end), bytes.fromhex(digest)))
+            self.file = open(path, "a")
+
+    @staticmethod
+    def key(
+        start: int, end: int, challenges: list[bytes], ys: list[bytes], proof: bytes
+    ) -> tuple[int, int, bytes]:
+        H = sha256(proof)
+        for x in challenges + ys:
+            H.update(len(x).to_bytes(4, "big") + x)
+        return start, end, H.digest()
+
+    def remember(self, key: tuple[int, int, bytes]):
+        self.entries[key] = None
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def verify(self, key: tuple[int, int, bytes], fn: Callable[[], bool]) -> bool:
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return True
+                event = self.inflight.get(key)
+                if event is None:
+                    event = self.inflight[key] = Event()
+                    break
+            # someone else is verifying this window, use their result
+            event.wait()
+        ok = False
+        try:
+            ok = fn()
+        finally:
+            with self.lock:
+                del self.inflight[key]
+                if ok:
+                    self.remember(key)
+                    if self.file is not None:
+                        self.file.write(f"{key[0]} {key[1]} {key[2].hex()}\n")
+                        self.file.flush()
+            event.set()
+        return ok
+
+
+def stage_range_params(start: int, end: int, proofs: Optional[list[int]]) -> dict:
+    if proofs is None:
+        # the server's default, one proof per window counting back from end
+        return {"start": start, "end": end}
+    proofs_arg = ",".join(str(idx) for idx in proofs) or "none"
+    return {"start": start, "end": end, "proofs": proofs_arg}
+
+
+def stage_range_infos(start: int, content: bytes) -> list[StageInfo]:
+    records, proofs = wire.unpack_range(content)
+    infos = []
+    if start < 0:
+        # the server only encodes real stages, stage -1 is the fixed one
+        infos.append(
+            StageInfo(stage=-1, phase=Phase.DONE, contributions=0, accval=b"", vdfy=b"")
+        )
+    for record in records:
+        if record["stage"] in proofs:
+            record["vdfproof"] = proofs[record["stage"]]
+        infos.append(StageInfo(**record))
+    return infos
+
+
+def accproof_from_response(res: httpx.Response):
+    res.raise_for_status()
+    if res.headers.get("Content-Type") == "application/octet-stream":
+        return Parameters.accumulator.unpack_witness(res.content)
+    # server without the compact format
+    return msgpack.unpackb(res.content)
+
+
+class RangeCache:
+    # finished stage ranges by request parameters, revalidated with their ETag
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.entries: OrderedDict[tuple, tuple[str, list[StageInfo]]] = OrderedDict()
+
+    def get(self, params: dict) -> Optional[tuple[str, list[StageInfo]]]:
+        key = tuple(params.values())
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        return None
+
+    def put(self, params: dict, etag: Optional[str], infos: list[StageInfo]):
+        if etag is None or any(info.phase < Phase.DONE for info in infos):
+            return
+        self.entries[tuple(params.values())] = (etag, infos)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+
+# relative cost of verifying an aggregated proof over n stages is
+# WINDOW_FIXED_COST + n, the fixed part being the hash-to-prime and the
+# exponentiations by B and r that every proof needs
+WINDOW_FIXED_COST = 8
+
+
+def plan_windows(
+    W: int,
+    contribution_stage: int,
+    stage_idx: int,
+    checkpoints: list[dict] = [],
+) -> list[tuple[int, int, Optional[bytes]]]:
+    """
+    Choose the cheapest set of proofs that covers [contribution_stage, stage_idx].
+
+    Each stage t proves [max(t - W + 1, 0), t] with its own proof (returned with
+    proof None), and `checkpoints` as returned by /api/checkpoints prove longer
+    windows. Returns (start, end, proof) triples in chain order.
+
+    The number of proofs is logarithmic in the gap only up to the longest
+    checkpoint window, W * 2^checkpoint_levels stages (160 by default); past
+    that it grows linearly, by one proof per longest window.
+    """
+    by_window = {(cp["start"], cp["end"]): cp["proof"] for cp in checkpoints}
+    lengths = sorted({cp["end"] - cp["start"] + 1 for cp in checkpoints})
+    # Dijkstra over p = "[contribution_stage, p] is covered"
+    source = contribution_stage - 1
+    dist = {source: 0}
+    back: dict[int, tuple[int, tuple[int, int, Optional[bytes]]]] = {}
+    heap = [(0, source)]
+    while heap:
+        d, p = heapq.heappop(heap)
+        if p == stage_idx:
+            break
+        if d > dist[p]:
+            continue
+        edges = []
+        for end in range(p + 1, min(p + W, stage_idx) + 1):
+            edges.append((max(end - W + 1, 0), end, None))
+        for L in lengths:
+            # checkpoint windows are aligned, so at most one per length contains p + 1
+            end = (p + 1) // L * L + L - 1
+            if end <= stage_idx and (end - L + 1, end) in by_window:
+                edges.append((end - L + 1, end, by_window[(end - L + 1, end)]))
+        for window in edges:
+            start, end, _ = window
+            nd = d + WINDOW_FIXED_COST + end - start + 1
+            if nd < dist.get(end, nd + 1):
+                dist[end] = nd
+                back[end] = (p, window)
+                heapq.heappush(heap, (nd, end))
+    windows = []
+    p = stage_idx
+    while p != source:
+        p, window = back[p]
+        windows.append(window)
+    windows.reverse()
+    return windows
+
+
+def verify_randomness(
+    contribution: Contribution,
+    stage_idx: int,
+    windows: list[tuple[int, int, Optional[bytes]]],
+    extra: StageInfo,
+    stages: list[StageInfo],
+    accproof,
+    cache: Optional[VerifiedWindowCache] = None,
+) -> bytes:
+    # `stages` covers `windows` (see plan_windows), `extra` is the stage right
+    # before them
+    start = min(st for st, _, _ in windows)
+
+    # first, verify it is included in accumulator
+    contributed_stage = next(stg for stg in stages if stg.stage == contribution.stage)
+    if not Parameters.accumulator.verify(
+        contributed_stage.accval, accproof, contribution.value
+    ):
+        raise ValueError("accumulator verification failed")
+
+    # then we construct the challenges and ys
+    vdf_challenges = [
+        Parameters.hash(cur.accval + prev.vdfy)
+        for cur, prev in zip(stages, [extra] + stages)
+    ]
+    vdf_ys = [stg.vdfy for stg in stages]
+    # verify the vdf proofs
+    for st, ed, proof in windows:
+        st_idx, ed_idx = st - start, ed - start
+        challenges = vdf_challenges[st_idx : ed_idx + 1]
+        ys = vdf_ys[st_idx : ed_idx + 1]
+        if proof is None:
+            proof = stages[ed_idx].vdfproof
+        if cache is None:
+            ok = Parameters.avdf.verify(challenges, ys, proof)
+        else:
+            key = cache.key(st, ed, challenges, ys, proof)
+            ok = cache.verify(
+                key, lambda: Parameters.avdf.verify(challenges, ys, proof)
+            )
+        if not ok:
+            raise ValueError("vdf verification failed")
+
+    target_stage = next(stg for stg in stages if stg.stage == stage_idx)
+    return target_stage.vdfy
+
+
 class HeadStartClient:
     @staticmethod
     def from_server_url(url: str) -> "HeadStartClient":
@@ -38,11 +322,17 @@ class HeadStartClient:
         return HeadStartClient(client, pub_key, W)
 
     def __init__(
-        self, client: httpx.Client, pub_key: public_key.Ed25519PublicKey, W: int
+        self,
+        client: httpx.Client,
+        pub_key: public_key.Ed25519PublicKey,
+        W: int,
+        cache: Optional[VerifiedWindowCache] = None,
     ):
         self.client = client
         self.pub_key = pub_key
         self.W = W
+        self.cache = cache if cache is not None else VerifiedWindowCache()
+        self.ranges = RangeCache()
 
     def get_info(self) -> StageInfo:
         return StageInfo(**msgpack.unpackb(self.client.get("/api/info").content))
@@ -57,10 +347,21 @@ class HeadStartClient:
                 ).content
             ),
         )
-        if not public_key.verify(self.pub_key, ct.value, ct.signature):
+        if not verify_receipt(self.pub_key, ct):
             raise ValueError("invalid signature")
         return ct
 
+    def contribute_many(self, randomness: list[bytes]) -> list[Contribution]:
+        # every returned contribution carries the shared batch receipt
+        res = msgpack.unpackb(
+            self.client.post(
+                "/api/contribute_batch",
+                content=msgpack.packb(randomness),
+                headers={"Content-Type": "application/msgpack"},
+            ).content
+        )
+        return batch_contributions(self.pub_key, randomness, res)
+
     def get_stage(self, stage_idx: int) -> StageInfo:
         return StageInfo(
             **msgpack.unpackb(self.client.get(f"/api/stage/{stage_idx}").content)
@@ -72,12 +373,57 @@ class HeadStartClient:
         )
         return [StageInfo(**x) for x in res]
 
+    def get_stage_range(
+        self, start: int, end: int, proofs: Optional[list[int]] = None
+    ) -> list[StageInfo]:
+        # like get_stages, but only with the proofs of the stages in `proofs`
+        # (one per window if None) and using the compact binary encoding
+        params = stage_range_params(start, end, proofs)
+        cached = self.ranges.get(params)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        res = self.client.get("/api/stage_range", params=params, headers=headers)
+        if res.status_code == 304 and cached:
+            return cached[1]
+        if res.status_code == 404:
+            # server without the binary endpoint
+            return self.get_stages(start, end)
+        res.raise_for_status()
+        infos = stage_range_infos(start, res.content)
+        self.ranges.put(params, res.headers.get("ETag"), infos)
+        return infos
+
+    def wait_stage(self, stage_idx: int, phase: Phase, timeout=30) -> StageInfo:
+        # long-poll, returns early once the stage reaches `phase`
+        res = self.client.get(
+            f"/api/stage/{stage_idx}/wait",
+            params={"phase": phase.name, "timeout": timeout},
+            timeout=timeout + 10,
+        )
+        res.raise_for_status()
+        return StageInfo(**msgpack.unpackb(res.content))
+
+    def get_checkpoints(self, start: int, end: int) -> list[dict]:
+        res = self.client.get(f"/api/checkpoints", params={"start": start, "end": end})
+        if res.status_code == 404:
+            # server without checkpoint proofs
+            return []
+        return msgpack.unpackb(res.content)
+
     def get_stage_until(
         self, stage_idx: int, phase: Phase, polling_interval=1
     ) -> StageInfo:
-        while (info := self.get_stage(stage_idx)).phase < phase:
-            time.sleep(polling_interval)
-        return info
+        while True:
+            try:
+                info = self.wait_stage(stage_idx, phase)
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 404:
+                    raise
+                # server without long-polling, fall back to polling
+                info = self.get_stage(stage_idx)
+                if info.phase < phase:
+                    time.sleep(polling_interval)
+            if info.phase >= phase:
+                return info
 
     def __accval(self, stage_idx: int) -> bytes:
         return msgpack.unpackb(
@@ -85,11 +431,20 @@ class HeadStartClient:
         )
 
     def __accproof(self, contribution: Contribution):
-        return msgpack.unpackb(
-            self.client.get(
-                f"/api/stage/{contribution.stage}/accproof/{contribution.data_index}"
-            ).content
+        res = self.client.get(
+            f"/api/stage/{contribution.stage}/accproof/{contribution.data_index}",
+            params={"format": "compact"},
         )
+        return accproof_from_response(res)
+
+    def get_acc_proofs(self, stage_idx: int, data_indices: list[int]) -> bytes:
+        # one multiproof for many contributions to a stage, check it with
+        # Parameters.accumulator.verify_many
+        res = self.client.post(
+            f"/api/stage/{stage_idx}/accproofs", content=msgpack.packb(data_indices)
+        )
+        res.raise_for_status()
+        return res.content
 
     def __vdfproof(self, stage: int) -> bytes:
         return msgpack.unpackb(self.client.get(f"/api/stage/{stage}/vdfproof").content)
@@ -103,55 +458,196 @@ class HeadStartClient:
         self, contribution: Contribution, stage_idx: int, polling_interval=1
     ) -> bytes:
         self.get_stage_until(stage_idx, Phase.DONE, polling_interval)
-        # our contribution are at contribution.stage
-        # and we want to get the randomness at stage_idx
-        # each vdf proof in a stage proves [max(stage_idx - W + 1, 0), stage_idx] stages
-        # so we need to split the range into multiple ranges and round up correctly
-        # e.g. if stage_idx = 10, W = 5, contribution.stage = 7
-        # we need a proof for [6, 10]
-        # e.g. if stage_idx = 103, W = 10, contribution.stage = 77
-        # we need a proof for [76, 85], [85, 94], [94, 103]
-
-        ranges = []
-        target = stage_idx
-        while target >= contribution.stage:
-            ranges.append((max(target - self.W + 1, 0), target))
-            target -= self.W
-        ranges.reverse()
-        start = ranges[0][0]
-        end = ranges[-1][1]
-
-        extra, *stages = self.get_stages(
-            start - 1, end
-        )  # we want an extra one to get the y
-
-        # first, verify it is included in accumulator
-        contributed_stage = next(
-            stg for stg in stages if stg.stage == contribution.stage
+        windows = plan_windows(
+            self.W,
+            contribution.stage,
+            stage_idx,
+            self.get_checkpoints(contribution.stage, stage_idx),
         )
+        extra, *stages = self.get_stage_range(
+            min(st for st, _, _ in windows) - 1,
+            stage_idx,
+            [ed for _, ed, proof in windows if proof is None],
+        )  # we want an extra one to get the y
         accproof = self.__accproof(contribution)
-        if not Parameters.accumulator.verify(
-            contributed_stage.accval, accproof, contribution.value
-        ):
-            raise ValueError("accumulator verification failed")
-
-        # then we construct the challenges and ys
-        vdf_challenges = [
-            Parameters.hash(cur.accval + prev.vdfy)
-            for cur, prev in zip(stages, [extra] + stages)
+        return verify_randomness(
+            contribution, stage_idx, windows, extra, stages, accproof, self.cache
+        )
+
+
+class AsyncHeadStartClient:
+    """
+    asyncio version of HeadStartClient.
+
+    Concurrent waits on the same stage share one in-flight long-poll, so any
+    number of waiters costs one open request per stage.
+    """
+
+    @staticmethod
+    async def from_server_url(url: str) -> "AsyncHeadStartClient":
+        client = httpx.AsyncClient(base_url=url)
+        pub_bytes = (await client.get("/api/pubkey")).content
+        pub_key = serialization.load_pem_public_key(pub_bytes)
+        W = msgpack.unpackb((await client.get("/api/beacon_config")).content)[
+            "window_size"
         ]
-        vdf_ys = [stg.vdfy for stg in stages]
-        # verify the vdf proofs
-        shifted_ranges = [(x - start, y - start) for x, y in ranges]
-        for st_idx, ed_idx in shifted_ranges:
-            challenges = vdf_challenges[st_idx : ed_idx + 1]
-            ys = vdf_ys[st_idx : ed_idx + 1]
-            proof = stages[ed_idx].vdfproof
-            if not Parameters.avdf.verify(challenges, ys, proof):
-                raise ValueError("vdf verification failed")
+        return AsyncHeadStartClient(client, pub_key, W)
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        pub_key: public_key.Ed25519PublicKey,
+        W: int,
+        cache: Optional[VerifiedWindowCache] = None,
+    ):
+        self.client = client
+        self.pub_key = pub_key
+        self.W = W
+        self.cache = cache if cache is not None else VerifiedWindowCache()
+        self.ranges = RangeCache()
+        self.waits: dict[tuple[int, Phase], asyncio.Task] = {}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def get_info(self) -> StageInfo:
+        res = await self.client.get("/api/info")
+        return StageInfo(**msgpack.unpackb(res.content))
+
+    async def contribute(self, randomness: bytes) -> Contribution:
+        res = await self.client.post(
+            "/api/contribute",
+            json={"randomness": base64.b64encode(randomness).decode()},
+        )
+        ct = Contribution(value=randomness, **msgpack.unpackb(res.content))
+        if not verify_receipt(self.pub_key, ct):
+            raise ValueError("invalid signature")
+        return ct
+
+    async def contribute_many(self, randomness: list[bytes]) -> list[Contribution]:
+        res = msgpack.unpackb(
+            (
+                await self.client.post(
+                    "/api/contribute_batch",
+                    content=msgpack.packb(randomness),
+                    headers={"Content-Type": "application/msgpack"},
+                )
+            ).content
+        )
+        return batch_contributions(self.pub_key, randomness, res)
+
+    async def get_stage(self, stage_idx: int) -> StageInfo:
+        res = await self.client.get(f"/api/stage/{stage_idx}")
+        return StageInfo(**msgpack.unpackb(res.content))
+
+    async def get_stages(self, start: int, end: int) -> list[StageInfo]:
+        res = await self.client.get(f"/api/stage", params={"start": start, "end": end})
+        return [StageInfo(**x) for x in msgpack.unpackb(res.content)]
+
+    async def get_stage_range(
+        self, start: int, end: int, proofs: Optional[list[int]] = None
+    ) -> list[StageInfo]:
+        params = stage_range_params(start, end, proofs)
+        cached = self.ranges.get(params)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        res = await self.client.get("/api/stage_range", params=params, headers=headers)
+        if res.status_code == 304 and cached:
+            return cached[1]
+        if res.status_code == 404:
+            # server without the binary endpoint
+            return await self.get_stages(start, end)
+        res.raise_for_status()
+        infos = stage_range_infos(start, res.content)
+        self.ranges.put(params, res.headers.get("ETag"), infos)
+        return infos
+
+    async def get_checkpoints(self, start: int, end: int) -> list[dict]:
+        res = await self.client.get(
+            f"/api/checkpoints", params={"start": start, "end": end}
+        )
+        if res.status_code == 404:
+            # server without checkpoint proofs
+            return []
+        return msgpack.unpackb(res.content)
+
+    async def wait_stage(self, stage_idx: int, phase: Phase, timeout=30) -> StageInfo:
+        res = await self.client.get(
+            f"/api/stage/{stage_idx}/wait",
+            params={"phase": phase.name, "timeout": timeout},
+            timeout=timeout + 10,
+        )
+        res.raise_for_status()
+        return StageInfo(**msgpack.unpackb(res.content))
 
-        target_stage = next(stg for stg in stages if stg.stage == stage_idx)
-        return target_stage.vdfy
+    async def __wait_until(
+        self, stage_idx: int, phase: Phase, polling_interval=1
+    ) -> StageInfo:
+        try:
+            while True:
+                try:
+                    info = await self.wait_stage(stage_idx, phase)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code != 404:
+                        raise
+                    # server without long-polling, fall back to polling
+                    info = await self.get_stage(stage_idx)
+                    if info.phase < phase:
+                        await asyncio.sleep(polling_interval)
+                if info.phase >= phase:
+                    return info
+        finally:
+            del self.waits[(stage_idx, phase)]
+
+    async def get_stage_until(self, stage_idx: int, phase: Phase) -> StageInfo:
+        key = (stage_idx, phase)
+        if key not in self.waits:
+            self.waits[key] = asyncio.ensure_future(self.__wait_until(*key))
+        # shield so that one cancelled waiter doesn't cancel the shared request
+        return await asyncio.shield(self.waits[key])
+
+    async def __accproof(self, contribution: Contribution):
+        res = await self.client.get(
+            f"/api/stage/{contribution.stage}/accproof/{contribution.data_index}",
+            params={"format": "compact"},
+        )
+        return accproof_from_response(res)
+
+    async def get_acc_proofs(self, stage_idx: int, data_indices: list[int]) -> bytes:
+        res = await self.client.post(
+            f"/api/stage/{stage_idx}/accproofs", content=msgpack.packb(data_indices)
+        )
+        res.raise_for_status()
+        return res.content
+
+    async def get_verified_randomness(
+        self, contribution: Contribution, stage_idx: int
+    ) -> bytes:
+        await self.get_stage_until(stage_idx, Phase.DONE)
+        windows = plan_windows(
+            self.W,
+            contribution.stage,
+            stage_idx,
+            await self.get_checkpoints(contribution.stage, stage_idx),
+        )
+        (extra, *stages), accproof = await asyncio.gather(
+            self.get_stage_range(
+                min(st for st, _, _ in windows) - 1,
+                stage_idx,
+                [ed for _, ed, proof in windows if proof is None],
+            ),
+            self.__accproof(contribution),
+        )
+        # verification is CPU bound, keep it off the event loop
+        return await asyncio.to_thread(
+            verify_randomness,
+            contribution,
+            stage_idx,
+            windows,
+            extra,
+            stages,
+            accproof,
+            self.cache,
+        )
 
 
 if __name__ == "__main__":
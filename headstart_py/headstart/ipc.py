@@ -0,0 +1,236 @@
+from multiprocessing.connection import (
+    AuthenticationError,
+    Client,
+    Connection,
+    Listener,
+)
+from concurrent.futures import Future
+from threading import Thread, Lock
+from typing import Optional
+import logging, os, queue, secrets
+
+# This lets any number of HTTP workers share one stage chain: a single beacon
+# process owns the RandomnessBeacon (the only writer), and the workers talk to
+# it through BeaconProxy over a unix socket.
+
+# methods of RandomnessBeacon that may be called remotely
+METHODS = {
+    "contribute_many",
+    "contribute_batch",
+    "config",
+    "info",
+    "stage_info",
+    "stage_infos",
+    "acc_proof",
+    "acc_multiproof",
+    "wait_stage",
+    "checkpoints",
+    "stage_range",
+    "finalized_index",
+}
+
+
+def load_authkey(address: str, create: bool = False) -> bytes:
+    # the secret shared by the beacon process and the HTTP workers, taken from
+    # HEADSTART_BEACON_KEY or else a key file next to the socket
+    if "HEADSTART_BEACON_KEY" in os.environ:
+        return os.environ["HEADSTART_BEACON_KEY"].encode()
+    path = os.environ.get("HEADSTART_BEACON_KEY_FILE", address + ".key")
+    if create:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, "wb") as f:
+                f.write(secrets.token_bytes(32))
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class BeaconService:
+    def __init__(self, beacon, address: str, authkey: bytes):
+        self.beacon = beacon
+        self.address = address
+        if os.path.exists(address):
+            os.remove(address)
+        # bind under a restrictive umask, a chmod afterwards leaves a window
+        # in which anyone can connect
+        umask = os.umask(0o177)
+        try:
+            self.listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        finally:
+            os.umask(umask)
+
+    def serve_forever(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                logging.getLogger(__name__).warning("rejected unauthenticated client")
+                continue
+            Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def handle(self, conn: Connection):
+        with conn:
+            while True:
+                try:
+                    method, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                if method not in METHODS:
+                    conn.send(("error", f"unknown method {method}"))
+                    continue
+                try:
+                    conn.send(("ok", getattr(self.beacon, method)(*args)))
+                except ValueError as e:
+                    conn.send(("error", str(e)))
+                except Exception as e:
+                    # report it to the caller instead of dropping the connection
+                    logging.getLogger(__name__).exception(f"{method} failed")
+                    conn.send(("err", repr(e)))
+
+
+class BeaconProxy:
+    """
+    Client side of BeaconService with the same interface the HTTP handlers use.
+
+    Connections are pooled, and contributions from concurrent requests are
+    batched into a single `contribute_many` call.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        authkey: bytes,
+        max_batch: int = 256,
+        batch_delay: float = 0.002,
+    ):
+        self.address = address
+        self.authkey = authkey
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.pool: list[Connection] = []
+        self.pool_lock = Lock()
+        # in-flight long-polls, shared by all waiters on the same stage and phase
+        self.waits: dict[tuple[int, str], Future] = {}
+        self.waits_lock = Lock()
+        self.contributions: "queue.Queue[tuple[bytes, Future]]" = queue.Queue()
+        self.batch_thread = Thread(target=self.batch_loop, daemon=True)
+        self.batch_thread.start()
+
+    def call(self, method: str, *args):
+        with self.pool_lock:
+            conn = self.pool.pop() if self.pool else None
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+        try:
+            conn.send((method, args))
+            status, result = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        with self.pool_lock:
+            self.pool.append(conn)
+        if status == "error":
+            raise ValueError(result)
+        if status == "err":
+            raise RuntimeError(f"{method} failed in the beacon process: {result}")
+        return result
+
+    def batch_loop(self):
+        while True:
+            batch = [self.contributions.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self.contributions.get(timeout=self.batch_delay))
+            except queue.Empty:
+                pass
+            try:
+                results = self.call("contribute_many", [x for x, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(tuple(result))
+
+    def contribute(self, x: bytes) -> tuple[int, int, bytes]:
+        fut: Future = Future()
+        self.contributions.put((x, fut))
+        return fut.result()
+
+    def contribute_many(self, xs: list[bytes]) -> list[tuple[int, int, bytes]]:
+        return [tuple(r) for r in self.call("contribute_many", xs)]
+
+    def contribute_batch(self, xs: list[bytes]) -> tuple[int, int, bytes]:
+        return tuple(self.call("contribute_batch", xs))
+
+    def config(self) -> dict:
+        return self.call("config")
+
+    def info(self) -> dict:
+        return self.call("info")
+
+    def stage_info(self, idx: int) -> dict:
+        return self.call("stage_info", idx)
+
+    def stage_infos(self, start: int, end: Optional[int] = None) -> list[dict]:
+        return self.call("stage_infos", start, end)
+
+    def acc_proof(self, stage_idx: int, data_idx: int, compact: bool = False):
+        return self.call("acc_proof", stage_idx, data_idx, compact)
+
+    def acc_multiproof(self, stage_idx: int, data_indices: list[int]) -> bytes:
+        return self.call("acc_multiproof", stage_idx, data_indices)
+
+    def stage_range(
+        self, start: int, end: Optional[int] = None, proofs: Optional[list[int]] = None
+    ) -> bytes:
+        return self.call("stage_range", start, end, proofs)
+
+    def checkpoints(self, start: int, end: int) -> list[dict]:
+        return self.call("checkpoints", start, end)
+
+    def finalized_index(self) -> int:
+        return self.call("finalized_index")
+
+    def wait_stage(self, idx: int, phase: str, timeout: float) -> dict:
+        key = (idx, phase)
+        with self.waits_lock:
+            fut = self.waits.get(key)
+            owner = fut is None
+            if owner:
+                fut = self.waits[key] = Future()
+        if not owner:
+            return fut.result()
+        try:
+            fut.set_result(self.call("wait_stage", idx, phase, timeout))
+        except BaseException as e:
+            fut.set_exception(e)
+        finally:
+            with self.waits_lock:
+                del self.waits[key]
+        return fut.result()
+
+
+if __name__ == "__main__":
+    from headstart.beacon import RandomnessBeacon
+    from headstart.storage import StageStore, StageLog
+    from cryptography.hazmat.primitives import serialization
+
+    logging.basicConfig(level=logging.INFO)
+    with open("priv.key", "rb") as f:
+        priv_key = serialization.load_pem_private_key(
+            f.read(), password=None, backend=None
+        )
+    stage_dir = os.environ.get("HEADSTART_STAGE_DIR", "stages")
+    beacon = RandomnessBeacon(
+        logging.getLogger("headstart.beacon"),
+        priv_key,
+        StageStore(stage_dir),
+        StageLog(stage_dir),
+    )
+    beacon.register_scheduler()
+    address = os.environ.get("HEADSTART_BEACON_SOCKET", "beacon.sock")
+    BeaconService(beacon, address, load_authkey(address, create=True)).serve_forever()
@@ -105,6 +105,33 @@ def qf_pow(x: BinaryQF, n: int) -> BinaryQF:
     return r
 
 
+def qf_multi_pow(xs: list[BinaryQF], ns: list[int], w: int = 4) -> BinaryQF:
+    # compute prod(x_i^n_i) with a single shared squaring chain (Straus)
+    if len(xs) != len(ns):
+        raise ValueError("xs and ns must have the same length")
+    if not xs:
+        raise ValueError("empty multi-exponentiation")
+    r = get_qf_principal_form(xs[0].discriminant())
+    # tables[i][j] = x_i^j for 0 < j < 2^w
+    tables = []
+    for x in xs:
+        x = x.reduced_form()
+        t = [r, x]
+        for _ in range(2, 1 << w):
+            t.append((t[-1] * x).reduced_form())
+        tables.append(t)
+    mask = (1 << w) - 1
+    nbits = max(n.bit_length() for n in ns)
+    for shift in range((nbits + w - 1) // w * w - w, -1, -w):
+        for _ in range(w):
+            r = (r * r).reduced_form()
+        for t, n in zip(tables, ns):
+            d = (n >> shift) & mask
+            if d:
+                r = (r * t[d]).reduced_form()
+    return r
+
+
 def qf_tobytes(x: BinaryQF, b: int) -> bytes:
     r = b""
     for v in x:
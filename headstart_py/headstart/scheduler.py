@@ -0,0 +1,114 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from typing import TYPE_CHECKING, Callable, Optional
+import logging, os, queue, threading
+
+if TYPE_CHECKING:
+    from headstart.stage import Stage
+
+
+def lower_priority():
+    # on Linux the niceness of a thread can be set through its native id
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+class VDFScheduler:
+    """
+    Runs the VDF work of closed stages with bounded resources.
+
+    Evaluations form a chain (each challenge depends on the previous y), so they
+    run in order on a single evaluation thread. Aggregations of finished stages
+    are independent of each other and go to a fixed-size worker pool.
+    Checkpoint proofs are not on the chain's critical path and get their own
+    single worker at a lower OS priority, so they never delay an aggregation.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        max_pending: int,
+        aggregate_workers: int = 2,
+        on_evaluated: Optional[Callable[["Stage"], None]] = None,
+        on_aggregated: Optional[Callable[["Stage"], None]] = None,
+    ):
+        self.logger = logger
+        self.on_evaluated = on_evaluated
+        self.on_aggregated = on_aggregated
+        # number of closed stages allowed to be unfinished at once
+        self.max_pending = max_pending
+        self.eval_queue: "queue.Queue[Optional[Stage]]" = queue.Queue()
+        self.aggregate_pool = ThreadPoolExecutor(
+            max_workers=aggregate_workers, thread_name_prefix="vdf-aggregate"
+        )
+        self.checkpoint_pool = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="vdf-checkpoint",
+            initializer=lower_priority,
+        )
+        self.lock = Lock()
+        self.pending = 0
+        self.aggregating = 0
+        self.last_done: Optional["Stage"] = None
+        self.eval_thread = Thread(target=self.eval_loop, daemon=True)
+        self.eval_thread.start()
+
+    def admit(self) -> bool:
+        # back-pressure: refuse new stages while the pipeline is saturated
+        with self.lock:
+            return self.pending < self.max_pending
+
+    def submit(self, stage: "Stage"):
+        with self.lock:
+            self.pending += 1
+        self.eval_queue.put(stage)
+
+    def eval_loop(self):
+        while (stage := self.eval_queue.get()) is not None:
+            try:
+                stage.evaluate()
+                if self.on_evaluated:
+                    self.on_evaluated(stage)
+            except Exception:
+                self.logger.exception("VDF evaluation failed")
+                with self.lock:
+                    self.pending -= 1
+                continue
+            with self.lock:
+                self.aggregating += 1
+            self.aggregate_pool.submit(self.aggregate, stage)
+
+    def aggregate(self, stage: "Stage"):
+        try:
+            stage.aggregate()
+            if self.on_aggregated:
+                self.on_aggregated(stage)
+        except Exception:
+            self.logger.exception("VDF aggregation failed")
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.aggregating -= 1
+                if stage.done.is_set():
+                    self.last_done = stage
+
+    def metrics(self) -> dict:
+        with self.lock:
+            ret = {
+                "queue_depth": self.eval_queue.qsize(),
+                "aggregate_queue_depth": self.aggregating,
+                "pending": self.pending,
+            }
+            last = self.last_done
+        if last is not None:
+            if last.eval_started_at is not None:
+                ret["eval_time"] = last.y_at - last.eval_started_at
+            ret["aggregate_time"] = last.done_at - last.aggregate_started_at
+        return ret
+
+    def shutdown(self):
+        self.eval_queue.put(None)
+        self.aggregate_pool.shutdown(wait=False, cancel_futures=True)
+        self.checkpoint_pool.shutdown(wait=False, cancel_futures=True)
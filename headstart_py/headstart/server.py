@@ -1,10 +1,11 @@
 from flask import Flask, request, make_response
 from werkzeug.exceptions import HTTPException
 from flask.json.provider import JSONProvider
-from apscheduler.schedulers.background import BackgroundScheduler
-import atexit, logging, base64, json, msgpack
-from headstart.stage import Stage, Phase
-import headstart.public_key as public_key
+import logging, base64, json, msgpack, os
+from headstart.beacon import RandomnessBeacon
+from headstart.stage import Phase
+from headstart.ipc import BeaconProxy, load_authkey
+from headstart.storage import StageStore, StageLog
 from cryptography.hazmat.primitives import serialization
 
 
@@ -14,59 +15,6 @@ with open("pub.key", "rb") as f:
     public_bytes = f.read()
 
 
-class RandomnessBeacon:
-    def __init__(self, logger: logging.Logger, priv_key: public_key.Ed25519PrivateKey):
-        self.logger = logger
-        self.stages: list[Stage] = [Stage()]
-        self.interval_seconds = 3
-        self.W = 10
-        self.priv_key = priv_key
-
-    @property
-    def current_stage(self):
-        return self.stages[-1]
-
-    @property
-    def current_stage_index(self):
-        return len(self.stages) - 1
-
-    def get_stage(self, stage_idx: int):
-        if not (0 <= stage_idx <= self.current_stage_index):
-            raise ValueError("invalid stage")
-        return self.stages[stage_idx]
-
-    def get_stage_after_phase(self, stage_idx: int, phase: Phase):
-        stage = self.get_stage(stage_idx)
-        if stage.phase < phase:
-            raise ValueError("not in correct phase")
-        return stage
-
-    def contribute(self, x: bytes):
-        self.logger.debug(
-            f"Contribution received",
-            extra={"x": x.hex(), "stage": self.current_stage_index},
-        )
-        data_idx = self.current_stage.contribute(x)
-        stage_idx = self.current_stage_index
-        sig = public_key.sign(self.priv_key, x)
-        return stage_idx, data_idx, sig
-
-    def next_stage(self):
-        self.logger.info(f"Starting next stage #{self.current_stage_index + 1}")
-        self.current_stage.stop_contribution()
-        prev_stages = self.stages[-self.W + 1 :]
-        self.stages.append(Stage(prev_stages))
-
-    def register_scheduler(self):
-        scheduler = BackgroundScheduler()
-        scheduler.add_job(
-            func=self.next_stage, trigger="interval", seconds=self.interval_seconds
-        )
-        scheduler.start()
-        atexit.register(lambda: scheduler.shutdown())
-        self.scheduler = scheduler
-
-
 def msgpackify(obj):
     resp = make_response(msgpack.packb(obj))
     resp.headers["Content-Type"] = "application/msgpack"
@@ -94,8 +42,16 @@ def handle_exception(e):
     return response
 
 
-beacon = RandomnessBeacon(app.logger, priv_key)
-beacon.register_scheduler()
+if "HEADSTART_BEACON_SOCKET" in os.environ:
+    # the beacon runs in its own process, see headstart.ipc
+    address = os.environ["HEADSTART_BEACON_SOCKET"]
+    beacon = BeaconProxy(address, load_authkey(address))
+else:
+    stage_dir = os.environ.get("HEADSTART_STAGE_DIR", "stages")
+    beacon = RandomnessBeacon(
+        app.logger, priv_key, StageStore(stage_dir), StageLog(stage_dir)
+    )
+    beacon.register_scheduler()
 
 
 @app.get("/api/pubkey")
@@ -107,23 +63,12 @@ def pubkey():
 
 @app.get("/api/beacon_config")
 def beacon_config():
-    return msgpackify(
-        {
-            "interval_seconds": beacon.interval_seconds,
-            "window_size": beacon.W,
-        }
-    )
+    return msgpackify(beacon.config())
 
 
 @app.get("/api/info")
 def info():
-    return msgpackify(
-        {
-            "stage": beacon.current_stage_index,
-            "phase": beacon.current_stage.phase.name,
-            "contributions": len(beacon.current_stage.data),
-        }
-    )
+    return msgpackify(beacon.info())
 
 
 @app.post("/api/contribute")
@@ -141,50 +86,139 @@ def contribute():
     return msgpackify({"stage": stage_idx, "data_index": data_idx, "signature": sig})
 
 
-def get_stage(idx):
-    if idx == -1:
-        # for client implementation convenience
-        return {
-            "stage": -1,
-            "phase": "DONE",
-            "contributions": 0,
-            "vdfy": b"",
-            "accval": b"",
-            "vdfchallenge": b"",
-            "vdfproof": b"",
-            "randomness": b"",
-        }
+MAX_BATCH_SIZE = 1 << 16
+
+
+@app.post("/api/contribute_batch")
+def contribute_batch():
     try:
-        stage = beacon.get_stage(idx)
-    except ValueError:
-        return {"stage": idx, "phase": "NONE", "contributions": 0}
-    ret = {
-        "stage": idx,
-        "phase": stage.phase.name,
-        "contributions": len(stage.data),
-    }
-    if stage.phase >= Phase.EVALUATION:
-        ret["accval"] = stage.get_acc_val()
-    if stage.phase >= Phase.DONE:
-        ret["vdfy"] = stage.get_final_y()
-        ret["vdfproof"] = stage.get_vdf_proof()
-    return ret
+        xs = msgpack.unpackb(request.get_data())
+        if not isinstance(xs, list) or not all(isinstance(x, bytes) for x in xs):
+            raise ValueError
+    except:
+        return (
+            msgpackify({"error": "body must be a msgpack array of binary values"}),
+            400,
+        )
+    if not (0 < len(xs) <= MAX_BATCH_SIZE):
+        return (
+            msgpackify({"error": f"batch size must be in [1, {MAX_BATCH_SIZE}]"}),
+            400,
+        )
+    stage_idx, data_idx, sig = beacon.contribute_batch(xs)
+    return msgpackify(
+        {"stage": stage_idx, "data_index": data_idx, "count": len(xs), "signature": sig}
+    )
 
 
 @app.get("/api/stage")
 def stages():
     # inclusive
     start_idx = int(request.args.get("start", 0))
-    end_idx = int(request.args.get("end", beacon.current_stage_index))
-    return msgpackify([get_stage(idx) for idx in range(start_idx, end_idx + 1)])
+    end_idx = request.args.get("end", None, type=int)
+    return msgpackify(beacon.stage_infos(start_idx, end_idx))
 
 
 @app.get("/api/stage/<int:stage_idx>")
 def stage(stage_idx):
-    return msgpackify(get_stage(stage_idx))
+    return msgpackify(beacon.stage_info(stage_idx))
+
+
+MAX_RANGE_SIZE = 1 << 14
+
+
+@app.get("/api/stage_range")
+def stage_range():
+    # binary version of /api/stage, see headstart.wire for the format
+    # `proofs` is "none" or a comma separated list of stage indices, one per
+    # window counting back from `end` if missing
+    try:
+        start_idx = int(request.args["start"])
+        end_idx = int(request.args["end"])
+        proofs_arg = request.args.get("proofs")
+        if proofs_arg is None:
+            proofs = None
+        elif proofs_arg == "none":
+            proofs = []
+        else:
+            proofs = [int(x) for x in proofs_arg.split(",")]
+    except (KeyError, ValueError):
+        return msgpackify({"error": "invalid range"}), 400
+    if not (0 <= end_idx - max(start_idx, 0) < MAX_RANGE_SIZE):
+        return msgpackify({"error": "invalid range"}), 400
+    # a range of finalized stages never changes, so its ETag follows from the
+    # request alone and a revalidation is answered without building the body
+    etag = None
+    if end_idx <= beacon.finalized_index():
+        etag = f"{start_idx}-{end_idx}-{proofs_arg or 'windows'}"
+        if request.if_none_match.contains(etag):
+            resp = make_response("", 304)
+            resp.set_etag(etag)
+            return resp
+    try:
+        body = beacon.stage_range(start_idx, end_idx, proofs)
+    except ValueError as e:
+        return msgpackify({"error": str(e)}), 400
+    resp = make_response(body)
+    resp.headers["Content-Type"] = "application/octet-stream"
+    if etag is not None:
+        resp.set_etag(etag)
+    return resp
+
+
+@app.get("/api/checkpoints")
+def checkpoints():
+    # checkpoint proofs whose last stage is in [start, end]
+    start_idx = request.args.get("start", 0, type=int)
+    end_idx = request.args.get("end", type=int)
+    if end_idx is None:
+        return msgpackify({"error": "end is required"}), 400
+    return msgpackify(beacon.checkpoints(start_idx, end_idx))
+
+
+MAX_WAIT_SECONDS = 60
+
+
+@app.get("/api/stage/<int:stage_idx>/wait")
+def wait_stage(stage_idx):
+    # long-poll: respond once the stage reaches `phase` or after `timeout` seconds
+    phase = request.args.get("phase", "DONE")
+    if phase not in Phase.__members__:
+        return msgpackify({"error": "invalid phase"}), 400
+    timeout = min(request.args.get("timeout", 30, type=float), MAX_WAIT_SECONDS)
+    return msgpackify(beacon.wait_stage(stage_idx, phase, timeout))
 
 
 @app.get("/api/stage/<int:stage_idx>/accproof/<int:data_idx>")
 def accproof(stage_idx, data_idx):
-    stage = beacon.get_stage_after_phase(stage_idx, Phase.EVALUATION)
-    return msgpackify(stage.get_acc_proof(data_idx))
+    if request.args.get("format") == "compact":
+        # see MerkleTree.pack_proof
+        resp = make_response(beacon.acc_proof(stage_idx, data_idx, True))
+        resp.headers["Content-Type"] = "application/octet-stream"
+        return resp
+    return msgpackify(beacon.acc_proof(stage_idx, data_idx))
+
+
+MAX_PROOF_BATCH_SIZE = 1 << 16
+
+
+@app.post("/api/stage/<int:stage_idx>/accproofs")
+def accproofs(stage_idx):
+    # one multiproof for a msgpack array of data indices, see
+    # MerkleTree.get_multiproof for the format
+    try:
+        indices = msgpack.unpackb(request.get_data())
+        if not isinstance(indices, list) or not all(
+            isinstance(i, int) for i in indices
+        ):
+            raise ValueError
+    except:
+        return msgpackify({"error": "body must be a msgpack array of indices"}), 400
+    if not (0 < len(indices) <= MAX_PROOF_BATCH_SIZE):
+        return (
+            msgpackify({"error": f"batch size must be in [1, {MAX_PROOF_BATCH_SIZE}]"}),
+            400,
+        )
+    resp = make_response(beacon.acc_multiproof(stage_idx, indices))
+    resp.headers["Content-Type"] = "application/octet-stream"
+    return resp
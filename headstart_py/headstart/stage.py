@@ -1,9 +1,9 @@
 from headstart.acc.merkle_tree import MerkleHash, MerkleTreeAccumulator
-from headstart.abstract import AggregateVDF
+from headstart.abstract import AbstractAccumulator, AggregateVDF
 from headstart.vdf.chia_vdf import SerializableChiaVDF, AggregateChiaVDF
 from hashlib import sha256
 from enum import Enum
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
 import sys, os, random, time
 from typing import Optional
 
@@ -27,14 +27,48 @@ class Parameters:
     accumulator = MerkleTreeAccumulator(MerkleHash(sha256))
     T = 2**10
     bits = 256
+    W = 10
+    # stage j * W * 2^l - 1 also publishes a proof over the W * 2^l stages
+    # ending at it, for l = 1..checkpoint_levels. Gaps longer than
+    # W * 2^checkpoint_levels still need one proof per such window.
+    checkpoint_levels = 4
     # vdf = SerializableChiaVDF(bits, T)
-    avdf = AggregateChiaVDF(bits, T)
+    # memory for the evaluation states of the last W stages, see
+    # AggregateChiaVDF.state_bytes; fewer stages are cached if they don't fit
+    avdf_cache_bytes = 256 << 20
+    avdf = AggregateChiaVDF(bits, T, cache_size=W, max_cache_bytes=avdf_cache_bytes)
 
     @staticmethod
     def hash(y: bytes):
         return sha256(y).digest()
 
 
+def checkpoint_windows(start: int, end: int) -> list[tuple[int, int]]:
+    # all checkpoint windows whose last stage is in [start, end]
+    ret = []
+    for level in range(1, Parameters.checkpoint_levels + 1):
+        L = Parameters.W << level
+        e = (max(start, 0) + 1 + L - 1) // L * L - 1
+        while e <= end:
+            ret.append((e - L + 1, e))
+            e += L
+    return ret
+
+
+def batch_receipt_message(stage_idx: int, data_index: int, xs: list[bytes]) -> bytes:
+    # the message signed for a batch of contributions stored at
+    # data[data_index : data_index + len(xs)] of stage `stage_idx`
+    acc = Parameters.accumulator
+    root = acc.get_bytes(acc.get_accval(acc.accumulate(xs)))
+    return (
+        b"batch"
+        + stage_idx.to_bytes(8, "big")
+        + data_index.to_bytes(8, "big")
+        + len(xs).to_bytes(8, "big")
+        + root
+    )
+
+
 class VDFComputation:
     def __init__(self, vdf: AggregateVDF, challenge: bytes):
         self.vdf = vdf
@@ -56,41 +90,138 @@ class VDFComputation:
 
 
 class Stage:
-    def __init__(self, prev_stages: list["Stage"] = []):
-        self.data: list[bytes] = [b"DUMMY VALUE"]  # to prevent some errors
+    def __init__(self, prev_stages: list["Stage"] = [], index: int = 0):
+        self.index = index
+        self.data: list[bytes] = []
+        # accumulated as contributions arrive, so closing the stage is cheap
+        self.acc_state = Parameters.accumulator.init()
+        self.append(b"DUMMY VALUE")  # to prevent some errors
         self.phase = Phase.CONTRIBUTION
         self.prev_stages = prev_stages
+        self.vdf_challenge: Optional[bytes] = None
+        self.vdf_y: Optional[bytes] = None
+        # set if the evaluation failed, the chain cannot continue past it
+        self.error: Optional[Exception] = None
+        # set once the evaluation finished, so the next stage can start its own
+        self.y_ready = Event()
+        # set once the stage reaches Phase.DONE
+        self.done = Event()
+        # monotonic timestamps of the stage lifecycle, for metrics
+        self.created_at = time.monotonic()
+        self.closed_at: Optional[float] = None
+        self.eval_started_at: Optional[float] = None
+        self.y_at: Optional[float] = None
+        self.aggregate_started_at: Optional[float] = None
+        self.done_at: Optional[float] = None
+
+    @property
+    def contributions(self):
+        return len(self.data)
+
+    def append(self, x: bytes):
+        self.data.append(x)
+        Parameters.accumulator.update(self.acc_state, x)
 
     def contribute(self, x: bytes):
         if self.phase != Phase.CONTRIBUTION:
             raise ValueError("not in contribution phase")
-        self.data.append(x)
+        self.append(x)
         return len(self.data) - 1  # index of x in the data
 
-    def stop_contribution(self):
+    @staticmethod
+    def restore(
+        prev_stages: list["Stage"],
+        index: int,
+        data: list[bytes],
+        phase: Phase,
+        vdf_challenge: Optional[bytes] = None,
+        vdf_y: Optional[bytes] = None,
+        vdf_proof: Optional[bytes] = None,
+    ) -> "Stage":
+        # rebuild a stage from persisted state, see headstart.storage.StageLog
+        stage = Stage(prev_stages, index)
+        stage.data = []
+        stage.acc_state = Parameters.accumulator.init()
+        for x in data:
+            stage.append(x)
+        if phase >= Phase.EVALUATION:
+            stage.close()
+        if vdf_y is not None:
+            stage.vdf_challenge = vdf_challenge
+            stage.vdf_y = vdf_y
+            # the evaluation happened before the restart, count it as instant
+            stage.eval_started_at = stage.y_at = stage.closed_at
+            stage.y_ready.set()
+        if vdf_proof is not None:
+            stage.vdf_proof = vdf_proof
+            stage.done_at = stage.closed_at
+            stage.prev_stages = []
+            stage.phase = Phase.DONE
+            stage.done.set()
+        return stage
+
+    def close(self):
         if self.phase != Phase.CONTRIBUTION:
             raise ValueError("not in contribution phase")
         self.phase = Phase.EVALUATION
-        self.acc = Parameters.accumulator.accumulate(self.data)
+        self.closed_at = time.monotonic()
+        self.acc = Parameters.accumulator.finalize(self.acc_state)
+        self.acc_state = None
+
+    @staticmethod
+    def needs_prepare() -> bool:
+        # the default prepare does nothing, don't schedule it
+        return type(Parameters.accumulator).prepare is not AbstractAccumulator.prepare
+
+    def prepare(self):
+        # precompute the accumulator witnesses, see AbstractAccumulator.prepare
+        Parameters.accumulator.prepare(self.acc, self.data)
+
+    def evaluate(self):
+        if self.y_ready.is_set():
+            # already known, e.g. restored after a restart
+            return
         if len(self.prev_stages) == 0:
             prev_stage_y = b""
         else:
             prev = self.prev_stages[-1]
-            while prev.phase < Phase.DONE:
-                time.sleep(1)
-            prev_stage_y = prev.get_final_y()
-        self.vdf_challenge = Parameters.hash(self.get_acc_val() + prev_stage_y)
-        self.vdf_thread = Thread(target=self.vdf_run)
-        self.vdf_thread.start()
-
-    def vdf_run(self):
-        self.vdf_y = Parameters.avdf.eval([self.vdf_challenge])[0]
+            prev.y_ready.wait()
+            if prev.error is not None:
+                self.error = ValueError(f"stage {prev.index} was not evaluated")
+                self.y_ready.set()
+                raise self.error
+            prev_stage_y = prev.vdf_y
+        try:
+            self.vdf_challenge = Parameters.hash(self.get_acc_val() + prev_stage_y)
+            self.eval_started_at = time.monotonic()
+            self.vdf_y = Parameters.avdf.eval([self.vdf_challenge])[0]
+            self.y_at = time.monotonic()
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            # wake the next stage either way, it checks `error`
+            self.y_ready.set()
+
+    def aggregate(self):
+        self.aggregate_started_at = time.monotonic()
         prev_challenges = [stage.vdf_challenge for stage in self.prev_stages]
         prev_ys = [stage.vdf_y for stage in self.prev_stages]
         self.vdf_proof = Parameters.avdf.aggregate(
             prev_challenges + [self.vdf_challenge], prev_ys + [self.vdf_y]
         )
+        self.done_at = time.monotonic()
+        # drop references to earlier stages so evicted stages can be freed
+        self.prev_stages = []
         self.phase = Phase.DONE
+        self.done.set()
+
+    def chain_lag(self) -> Optional[float]:
+        # seconds between closing the stage and its y being known
+        if self.closed_at is None:
+            return None
+        end = self.y_at if self.y_at is not None else time.monotonic()
+        return end - self.closed_at
 
     def get_acc_val(self):
         if self.phase < Phase.EVALUATION:
@@ -102,6 +233,11 @@ class Stage:
             raise ValueError("not in evaluation phase")
         return Parameters.accumulator.witgen(self.acc, self.data, data_index)
 
+    def get_acc_multiproof(self, data_indices: list[int]):
+        if self.phase < Phase.EVALUATION:
+            raise ValueError("not in evaluation phase")
+        return Parameters.accumulator.witgen_many(self.acc, self.data, data_indices)
+
     def get_vdf_proof(self):
         if self.phase < Phase.DONE:
             raise ValueError("not in done phase")
@@ -0,0 +1,372 @@
+from headstart.stage import Phase, Parameters
+from collections import OrderedDict
+from threading import Thread, Lock, Condition, Event
+from typing import Callable, Optional
+import os, time, msgpack
+
+
+def fsync_dir(directory: str):
+    # make a rename inside `directory` durable
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class CompactStage:
+    """
+    A finished stage that has been evicted from memory.
+
+    Only the values needed to serve and verify the stage are kept; the
+    contributions are loaded back from the store when an accumulator proof
+    is requested.
+    """
+
+    phase = Phase.DONE
+    error = None
+
+    def __init__(
+        self,
+        store: "StageStore",
+        idx: int,
+        contributions: int,
+        accval: bytes,
+        vdf_challenge: bytes,
+        vdf_y: bytes,
+        vdf_proof: bytes,
+    ):
+        self.store = store
+        self.idx = idx
+        self.contributions = contributions
+        self.accval = accval
+        self.vdf_challenge = vdf_challenge
+        self.vdf_y = vdf_y
+        self.vdf_proof = vdf_proof
+        self.y_ready = Event()
+        self.y_ready.set()
+        self.done = Event()
+        self.done.set()
+
+    def get_acc_val(self):
+        return self.accval
+
+    def get_acc_proof(self, data_index: int):
+        data, acc = self.store.load_accumulator(self.idx)
+        return Parameters.accumulator.witgen(acc, data, data_index)
+
+    def get_acc_multiproof(self, data_indices: list[int]):
+        data, acc = self.store.load_accumulator(self.idx)
+        return Parameters.accumulator.witgen_many(acc, data, data_indices)
+
+    def get_vdf_proof(self):
+        return self.vdf_proof
+
+    def get_final_y(self):
+        return self.vdf_y
+
+
+class StageStore:
+    """
+    On-disk storage for stages that fell out of the hot window.
+
+    Each stage is written once as two msgpack files: a small header with its
+    compact values and contribution count, and the contributions themselves.
+    Serving a stage only reads the header; the contributions are read when an
+    accumulator proof is requested. Recently used compact stages and rebuilt
+    accumulators are kept in small LRU caches.
+    """
+
+    def __init__(self, directory: str, cache_size: int = 64, acc_cache_size: int = 4):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.cache_size = cache_size
+        self.acc_cache_size = acc_cache_size
+        self.cache: OrderedDict[int, CompactStage] = OrderedDict()
+        self.acc_cache: OrderedDict[int, tuple] = OrderedDict()
+        self.lock = Lock()
+
+    def path(self, idx: int) -> str:
+        return os.path.join(self.directory, f"stage-{idx}.msgpack")
+
+    def header_path(self, idx: int) -> str:
+        return os.path.join(self.directory, f"stage-{idx}.header.msgpack")
+
+    @staticmethod
+    def write(path: str, record):
+        with open(path + ".tmp", "wb") as f:
+            msgpack.pack(record, f)
+            f.flush()
+            # the stage log forgets evicted stages, so this must be durable
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def put(self, idx: int, stage) -> CompactStage:
+        if stage.phase < Phase.DONE:
+            raise ValueError("only finished stages can be stored")
+        header = {
+            "accval": stage.get_acc_val(),
+            "vdfchallenge": stage.vdf_challenge,
+            "vdfy": stage.get_final_y(),
+            "vdfproof": stage.get_vdf_proof(),
+            "count": len(stage.data),
+        }
+        # the header is written last, a stage is stored once it exists
+        self.write(self.path(idx), {"data": stage.data})
+        self.write(self.header_path(idx), header)
+        fsync_dir(self.directory)
+        compact = self.compact(idx, header)
+        with self.lock:
+            self.remember(self.cache, idx, compact, self.cache_size)
+        return compact
+
+    def checkpoint_path(self, start: int, end: int) -> str:
+        return os.path.join(self.directory, f"checkpoint-{start}-{end}.msgpack")
+
+    def put_checkpoint(self, start: int, end: int, proof: bytes):
+        path = self.checkpoint_path(start, end)
+        with open(path + ".tmp", "wb") as f:
+            f.write(proof)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        fsync_dir(self.directory)
+
+    def get_checkpoint(self, start: int, end: int) -> Optional[bytes]:
+        try:
+            with open(self.checkpoint_path(start, end), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def read(self, idx: int) -> dict:
+        try:
+            with open(self.path(idx), "rb") as f:
+                return msgpack.unpack(f)
+        except FileNotFoundError:
+            raise ValueError("invalid stage")
+
+    def read_header(self, idx: int) -> dict:
+        try:
+            with open(self.header_path(idx), "rb") as f:
+                return msgpack.unpack(f)
+        except FileNotFoundError:
+            pass
+        # stores written before headers were split out keep a single record
+        record = self.read(idx)
+        record["count"] = len(record.pop("data"))
+        return record
+
+    def compact(self, idx: int, header: dict) -> CompactStage:
+        return CompactStage(
+            self,
+            idx,
+            header["count"],
+            header["accval"],
+            header["vdfchallenge"],
+            header["vdfy"],
+            header["vdfproof"],
+        )
+
+    def get(self, idx: int) -> CompactStage:
+        with self.lock:
+            if idx in self.cache:
+                self.cache.move_to_end(idx)
+                return self.cache[idx]
+        compact = self.compact(idx, self.read_header(idx))
+        with self.lock:
+            self.remember(self.cache, idx, compact, self.cache_size)
+        return compact
+
+    def load_accumulator(self, idx: int) -> tuple:
+        with self.lock:
+            if idx in self.acc_cache:
+                self.acc_cache.move_to_end(idx)
+                return self.acc_cache[idx]
+        data = self.read(idx)["data"]
+        entry = (data, Parameters.accumulator.accumulate(data))
+        with self.lock:
+            self.remember(self.acc_cache, idx, entry, self.acc_cache_size)
+        return entry
+
+    @staticmethod
+    def remember(cache: OrderedDict, key, value, size: int):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            cache.popitem(last=False)
+
+
+class StageLog:
+    """
+    Write-ahead log of the beacon state that is still in memory.
+
+    Records are msgpack arrays appended to a segment file and fsync'ed in
+    batches by a background thread. Callers that need durability (e.g. before
+    handing out a signed receipt) wait for their sequence number with `wait`.
+
+    Record types:
+        ["segment", first_stage_index]
+        ["stage", idx, phase, data, vdf_challenge, vdf_y, vdf_proof]
+        ["begin", idx]
+        ["contribute", idx, x]
+        ["close", idx]
+        ["evaluated", idx, vdf_challenge, vdf_y]
+        ["done", idx, vdf_proof]
+        ["evict", idx]
+
+    Every segment starts with a snapshot of the live stages, so only the newest
+    segment is needed for recovery and older ones are deleted on rotation. This
+    keeps the replay proportional to the live window rather than the history.
+    """
+
+    def __init__(self, directory: str, sync_interval: float = 0.01):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.sync_interval = sync_interval
+        # guards the buffer and sequence numbers, never held while writing
+        self.lock = Lock()
+        self.synced = Condition(self.lock)
+        # serializes writes to `file` between the flush thread and rotation
+        self.io_lock = Lock()
+        self.dirty = Event()
+        self.buffer: list[bytes] = []
+        self.file = None
+        self.segment: Optional[int] = None
+        self.seq = 0
+        self.synced_seq = 0
+        self.flush_thread = Thread(target=self.flush_loop, daemon=True)
+        self.flush_thread.start()
+
+    def segments(self) -> list[int]:
+        ret = []
+        for name in os.listdir(self.directory):
+            if name.startswith("log-") and name.endswith(".msgpack"):
+                ret.append(int(name[len("log-") : -len(".msgpack")]))
+        return sorted(ret)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"log-{segment}.msgpack")
+
+    def replay(self) -> Optional[tuple[int, dict[int, dict]]]:
+        """
+        Read the newest segment and return `(first_stage_index, stages)`, where
+        `stages` maps stage indices to their recovered state. Returns None if
+        there is no log yet. A torn record at the end of the log is ignored.
+        """
+        segments = self.segments()
+        if not segments:
+            return None
+        first = 0
+        stages: dict[int, dict] = {}
+        with open(self.segment_path(segments[-1]), "rb") as f:
+            unpacker = msgpack.Unpacker(f)
+            while True:
+                try:
+                    record = unpacker.unpack()
+                except msgpack.OutOfData:
+                    break
+                except Exception:
+                    # partially written record from a crash
+                    break
+                kind, args = record[0], record[1:]
+                if kind == "segment":
+                    first = args[0]
+                elif kind == "stage":
+                    idx, phase, data, challenge, y, proof = args
+                    stages[idx] = {
+                        "phase": Phase(phase),
+                        "data": data,
+                        "vdfchallenge": challenge,
+                        "vdfy": y,
+                        "vdfproof": proof,
+                    }
+                elif kind == "begin":
+                    stages[args[0]] = {
+                        "phase": Phase.CONTRIBUTION,
+                        "data": [b"DUMMY VALUE"],
+                        "vdfchallenge": None,
+                        "vdfy": None,
+                        "vdfproof": None,
+                    }
+                elif kind == "contribute":
+                    stages[args[0]]["data"].append(args[1])
+                elif kind == "close":
+                    stages[args[0]]["phase"] = Phase.EVALUATION
+                elif kind == "evaluated":
+                    stages[args[0]]["vdfchallenge"] = args[1]
+                    stages[args[0]]["vdfy"] = args[2]
+                elif kind == "done":
+                    stages[args[0]]["phase"] = Phase.DONE
+                    stages[args[0]]["vdfproof"] = args[1]
+                elif kind == "evict":
+                    stages.pop(args[0], None)
+                    first = args[0] + 1
+        return first, stages
+
+    def rotate(self, first_stage_index: int, snapshot: Callable[[], list[list]]):
+        """
+        Start a new segment beginning with the records returned by `snapshot`,
+        then delete the older segments. `snapshot` is called with the log lock
+        held, so no record can slip in between it and the new segment.
+        """
+        with self.io_lock, self.lock:
+            segment = 0 if self.segment is None else self.segment + 1
+            segment = max([segment] + [s + 1 for s in self.segments()])
+            path = self.segment_path(segment)
+            # only a complete snapshot may become the newest segment
+            f = open(path + ".tmp", "wb")
+            f.write(msgpack.packb(["segment", first_stage_index]))
+            for record in snapshot():
+                f.write(msgpack.packb(record))
+            f.flush()
+            os.fsync(f.fileno())
+            os.replace(path + ".tmp", path)
+            fsync_dir(self.directory)
+            old = self.file
+            self.file = f
+            self.segment = segment
+            # buffered records are covered by the snapshot
+            self.buffer = []
+            self.synced_seq = self.seq
+            self.synced.notify_all()
+        if old is not None:
+            old.close()
+        for s in self.segments():
+            if s < segment:
+                os.remove(self.segment_path(s))
+
+    def append(self, record: list) -> int:
+        record = msgpack.packb(record)
+        with self.lock:
+            self.buffer.append(record)
+            self.seq += 1
+            seq = self.seq
+        self.dirty.set()
+        return seq
+
+    def wait(self, seq: int):
+        # block until the record with sequence number `seq` is on disk
+        with self.lock:
+            while self.synced_seq < seq:
+                self.synced.wait()
+
+    def flush_loop(self):
+        while True:
+            self.dirty.wait()
+            # let a few more records join this batch
+            time.sleep(self.sync_interval)
+            self.dirty.clear()
+            with self.io_lock:
+                with self.lock:
+                    if self.file is None or self.synced_seq == self.seq:
+                        continue
+                    buffer, self.buffer = self.buffer, []
+                    seq = self.seq
+                # appends go on while the batch is written and synced
+                self.file.write(b"".join(buffer))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                with self.lock:
+                    self.synced_seq = max(self.synced_seq, seq)
+                    self.synced.notify_all()
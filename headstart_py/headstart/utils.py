@@ -1,6 +1,10 @@
 import gmpy2
-from hashlib import shake_256
-from typing import Generator
+from hashlib import shake_256, sha256
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Generator, Optional
+import fcntl, mmap, os, struct
 
 
 def H_kgen(x: bytes, k: int) -> Generator[int, None, None]:
@@ -22,3 +26,145 @@ def H_P(x: bytes, k: int) -> int:
         if gmpy2.is_prime(p):
             return p
     raise RuntimeError("unreachable")
+
+
+class PrimeCache:
+    """
+    Memo table for H_P.
+
+    Recently used primes are kept in an in-memory LRU of `size` entries. With
+    `path`, they are also stored in an mmap'ed open-addressing table of `slots`
+    slots, so they survive restarts and are shared between processes. Each slot
+    is sha256(k | x) followed by the prime, and a full probe window just
+    overwrites its first slot. Processes sharing the file take a POSIX record
+    lock on it, shared for lookups and exclusive for stores. The file is
+    trusted like the rest of the state directory, its primes are not checked
+    again.
+    """
+
+    SLOT = struct.Struct(">32s64s")
+    PROBES = 8
+
+    def __init__(
+        self, size: int = 1 << 16, path: Optional[str] = None, slots: int = 1 << 20
+    ):
+        self.size = size
+        self.entries: OrderedDict[tuple[int, bytes], int] = OrderedDict()
+        self.lock = Lock()
+        self.table = None
+        if path is not None:
+            # kept open for locking, record locks belong to the process, so
+            # they also separate processes forked after the file was opened
+            self.file = open(path, "a+b")
+            fcntl.lockf(self.file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self.file.fileno()).st_size != slots * self.SLOT.size:
+                    self.file.truncate(slots * self.SLOT.size)
+            finally:
+                fcntl.lockf(self.file, fcntl.LOCK_UN)
+            self.table = mmap.mmap(self.file.fileno(), slots * self.SLOT.size)
+            self.slots = slots
+
+    def remember(self, key: tuple[int, bytes], p: int):
+        self.entries[key] = p
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def slot_indices(self, digest: bytes):
+        start = int.from_bytes(digest[:8], "big") % self.slots
+        for i in range(self.PROBES):
+            yield (start + i) % self.slots * self.SLOT.size
+
+    def load(self, k: int, x: bytes) -> Optional[int]:
+        digest = sha256(k.to_bytes(2, "big") + x).digest()
+        for off in self.slot_indices(digest):
+            key, value = self.SLOT.unpack_from(self.table, off)
+            if key == digest:
+                return int.from_bytes(value[: (k + 7) // 8], "big")
+            if key == bytes(32):
+                return None
+        return None
+
+    def store(self, k: int, x: bytes, p: int):
+        if k > 8 * 64:
+            return
+        digest = sha256(k.to_bytes(2, "big") + x).digest()
+        offs = list(self.slot_indices(digest))
+        target = offs[0]
+        for off in offs:
+            key = self.table[off : off + 32]
+            if key == digest or key == bytes(32):
+                target = off
+                break
+        value = p.to_bytes((k + 7) // 8, "big").ljust(64, b"\x00")
+        # the prime goes in before the key that makes it visible
+        self.table[target + 32 : target + self.SLOT.size] = value
+        self.table[target : target + 32] = digest
+
+    @contextmanager
+    def file_lock(self, op: int):
+        if self.table is None:
+            yield
+            return
+        fcntl.lockf(self.file, op)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.file, fcntl.LOCK_UN)
+
+    def get(self, x: bytes, k: int) -> int:
+        return self.get_many([x], k)[0]
+
+    def get_many(self, xs: list[bytes], k: int) -> list[int]:
+        ret: list = [None] * len(xs)
+        missing: dict[bytes, list[int]] = {}
+        with self.lock, self.file_lock(fcntl.LOCK_SH):
+            for i, x in enumerate(xs):
+                p = self.entries.get((k, x))
+                if p is not None:
+                    self.entries.move_to_end((k, x))
+                    ret[i] = p
+                    continue
+                if self.table is not None:
+                    p = self.load(k, x)
+                if p is None:
+                    missing.setdefault(x, []).append(i)
+                else:
+                    ret[i] = p
+                    self.remember((k, x), p)
+        # hashing to primes is the slow part, don't hold the lock for it
+        found = {x: H_P(x, k) for x in missing}
+        if not found:
+            return ret
+        with self.lock, self.file_lock(fcntl.LOCK_EX):
+            for x, p in found.items():
+                for i in missing[x]:
+                    ret[i] = p
+                self.remember((k, x), p)
+                if self.table is not None:
+                    self.store(k, x, p)
+        return ret
+
+
+prime_cache: Optional[PrimeCache] = None
+prime_cache_lock = Lock()
+
+
+def get_prime_cache() -> PrimeCache:
+    # created on first use, so importing headstart opens no files and forked
+    # workers each map HEADSTART_PRIME_CACHE themselves
+    global prime_cache
+    with prime_cache_lock:
+        if prime_cache is None:
+            prime_cache = PrimeCache(path=os.environ.get("HEADSTART_PRIME_CACHE"))
+        return prime_cache
+
+
+def H_P_cached(x: bytes, k: int) -> int:
+    return get_prime_cache().get(x, k)
+
+
+def H_P_many(xs: list[bytes], k: int) -> list[int]:
+    # H_P of every element, each distinct element is only hashed once
+    return get_prime_cache().get_many(xs, k)
@@ -5,10 +5,17 @@ from chiavdf import (
     aggvdf_eval,
     aggvdf_prove,
     aggvdf_verify,
+    aggvdf_eval_state,
+    aggvdf_prove_states,
+    aggvdf_eval_and_prove,
 )
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from threading import Lock
+from typing import Optional
 from headstart.abstract import AbstractVDF, AggregateVDF
-import msgpack
+import math, msgpack
 from headstart.vdf.toy_vdf import H_D
 
 
@@ -73,18 +80,114 @@ def bytes2int(x):
 
 
 class AggregateChiaVDF(AggregateVDF):
+    """
+    Aggregated Wesolowski proofs over class groups, on chiavdf's aggvdf.
+
+    With `cache_size`, the AggVdfState of each evaluated challenge is kept so
+    a sliding window of W stages is evaluated once rather than W times. This
+    saves the evaluations, hashing to the group and serialization, not the
+    proof: the prime B depends on the whole window, so every aggregation
+    still computes a fresh quotient. That costs about 1.5 T group operations
+    on the aggregated generator, or T / k per VDF from its checkpoints,
+    whichever chiavdf finds cheaper. Each state holds about T / (k * l)
+    checkpoint forms (k and l as in ApproximateParameters), so the cache is
+    also capped at `max_cache_bytes`, see `state_bytes`.
+    """
+
     AGGREGATION_DISCRIMINANT_SEED = b"totally non-backdoored seed"  # should be constant
 
-    def __init__(self, bits: int, T: int):
+    def __init__(
+        self,
+        bits: int,
+        T: int,
+        cache_size: int = 0,
+        max_cache_bytes: Optional[int] = None,
+    ):
         self.bits = bits
         self.T = T
         self.d = H_D(self.AGGREGATION_DISCRIMINANT_SEED, 256)
-
-    def eval(self, challenges: list[bytes]) -> list[bytes]:
-        return aggvdf_eval(int2bytes(-self.d), self.T, challenges)
-
-    def aggregate(self, challenges: list[bytes], ys: list[bytes]) -> bytes:
-        return aggvdf_prove(int2bytes(-self.d), self.T, challenges, ys)
+        # states of the last `cache_size` evaluated challenges, so that
+        # aggregating a sliding window only evaluates the newest VDF once
+        if max_cache_bytes is not None:
+            cache_size = min(cache_size, max_cache_bytes // self.state_bytes())
+        self.cache_size = cache_size
+        self.states = OrderedDict()
+        self.states_lock = Lock()
+
+    def state_bytes(self) -> int:
+        # rough resident size of one cached state, its checkpoints dominate
+        log_memory = 23.25349666
+        l = 1
+        if math.log2(self.T) - log_memory > 0.000001:
+            l = math.ceil(2 ** (log_memory - 20))
+        x = self.T * 0.6931471 / (2 * l)
+        k = (
+            max(round(math.log(x) - math.log(math.log(x)) + 0.25), 1)
+            if x > math.e
+            else 1
+        )
+        forms = -(-self.T // (k * l)) + 2
+        # three mpz of about half the discriminant size, plus their headers and
+        # allocator overhead (measured ~150 bytes per form at 256 bits)
+        return forms * 3 * (32 + self.d.bit_length() // 8)
+
+    def eval(self, challenges: list[bytes], nthreads: int = 1) -> list[bytes]:
+        # independent challenges are evaluated on up to `nthreads` threads
+        d = int2bytes(-self.d)
+        if self.cache_size == 0:
+            return aggvdf_eval(d, self.T, challenges, nthreads)
+
+        def eval_state(challenge: bytes):
+            state = aggvdf_eval_state(d, self.T, challenge)
+            self.cache_state(challenge, state)
+            return state.y
+
+        if nthreads <= 1:
+            return [eval_state(challenge) for challenge in challenges]
+        with ThreadPoolExecutor(nthreads) as executor:
+            return list(executor.map(eval_state, challenges))
+
+    def cache_state(self, challenge: bytes, state):
+        with self.states_lock:
+            self.states[challenge] = state
+            self.states.move_to_end(challenge)
+            while len(self.states) > self.cache_size:
+                self.states.popitem(last=False)
+
+    def cached_states(self, challenges: list[bytes], ys: list[bytes]):
+        # all or nothing, a state only counts if it produced the same y
+        with self.states_lock:
+            states = [self.states.get(challenge) for challenge in challenges]
+        if any(state is None or state.y != y for state, y in zip(states, ys)):
+            return None
+        return states
+
+    def aggregate(
+        self, challenges: list[bytes], ys: list[bytes], nthreads: int = 1
+    ) -> bytes:
+        states = self.cached_states(challenges, ys)
+        if states is not None:
+            return aggvdf_prove_states(int2bytes(-self.d), self.T, states, nthreads)
+        return aggvdf_prove(int2bytes(-self.d), self.T, challenges, ys, nthreads)
+
+    def eval_and_aggregate(
+        self, challenges: list[bytes], checkpoint_interval: int = 0, nthreads: int = 1
+    ) -> tuple[list[bytes], bytes]:
+        # the quotient is taken from checkpoints stored while evaluating,
+        # `checkpoint_interval` squarings apart (0 picks it from T)
+        d = int2bytes(-self.d)
+        if self.cache_size == 0:
+            return aggvdf_eval_and_prove(
+                d, self.T, challenges, checkpoint_interval, nthreads
+            )
+        with self.states_lock:
+            states = [self.states.get(challenge) for challenge in challenges]
+        for i, challenge in enumerate(challenges):
+            if states[i] is None:
+                states[i] = aggvdf_eval_state(d, self.T, challenge, checkpoint_interval)
+                self.cache_state(challenge, states[i])
+        proof = aggvdf_prove_states(d, self.T, states, nthreads)
+        return [state.y for state in states], proof
 
     def verify(self, challenges: list[bytes], ys: list[bytes], proof: bytes) -> bool:
         return aggvdf_verify(int2bytes(-self.d), self.T, challenges, ys, proof)
@@ -108,3 +211,17 @@ if __name__ == "__main__":
     ys_extra = avdf.eval(challenges_extra)
     pi_all = avdf.aggregate(challenges + challenges_extra, ys + ys_extra)
     assert avdf.verify(challenges + challenges_extra, ys + ys_extra, pi_all)
+
+    cached = AggregateChiaVDF(1024, 1 << 16, cache_size=len(challenges))
+    assert cached.eval(challenges) == ys
+    assert avdf.eval(challenges, nthreads=2) == ys
+    assert cached.eval(challenges, nthreads=2) == ys
+    assert avdf.aggregate(challenges, ys, nthreads=2) == pi
+    assert cached.aggregate(challenges, ys, nthreads=2) == pi
+    assert cached.aggregate(challenges, ys) == pi
+    assert avdf.eval_and_aggregate(challenges) == (ys, pi)
+    assert avdf.eval_and_aggregate(challenges, checkpoint_interval=64) == (ys, pi)
+    assert cached.eval_and_aggregate(challenges + challenges_extra) == (
+        ys + ys_extra,
+        pi_all,
+    )
@@ -1,4 +1,4 @@
-from headstart.math.bqf import BinaryQF, get_qf_principal_form, qf_pow, qf_frombytes, qf_tobytes
+from headstart.math.bqf import BinaryQF, get_qf_principal_form, qf_pow, qf_multi_pow, qf_frombytes, qf_tobytes
 import gmpy2
 from hashlib import sha256, shake_256
 from typing import Generator
@@ -124,9 +124,7 @@ class AggregateToyVDF(AggregateVDF):
             for j in range(1, len(challenges) + 1)
         ]
         l = H_P(s, self.bits)
-        G = get_qf_principal_form(self.d)
-        for a_j, g_j in zip(a, gs):
-            G = (G * qf_pow(g_j, a_j)).reduced_form()
+        G = qf_multi_pow(gs, a)
         return gs, a, l, G
 
     def aggregate(self, challenges: list[bytes], ys: list[BinaryQF]) -> BinaryQF:
@@ -136,12 +134,10 @@ class AggregateToyVDF(AggregateVDF):
 
     def verify(self, challenges: list[bytes], ys: list[BinaryQF], pi: BinaryQF) -> bool:
         gs, a, l, G = self.compute_parameters(challenges, ys)
-        Y = get_qf_principal_form(self.d)
-        for a_j, y_j in zip(a, ys):
-            Y = (Y * qf_pow(y_j, a_j)).reduced_form()
+        Y = qf_multi_pow(ys, a)
         r = pow(2, self.T, l)
-        lhs = qf_pow(pi, l) * qf_pow(G, r)
-        return lhs.reduced_form() == Y
+        lhs = qf_multi_pow([pi, G], [l, r])
+        return lhs == Y
 
 
 if __name__ == "__main__":
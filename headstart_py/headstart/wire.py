@@ -0,0 +1,88 @@
+from headstart.stage import Phase
+from typing import Optional
+import struct
+
+# Compact binary encoding of a range of stages, served by /api/stage_range.
+#
+# header:  magic "HSR1" | accval size u16 | y size u16 | proof size u16
+#          | first stage u64 | record count u32
+# records: stage u64 | phase u8 | contributions u32 | accval | y
+#          (fixed width, fields a stage doesn't have yet are zero-filled)
+# proofs:  count u32, then per proof: stage u64 | proof
+#
+# All integers are big-endian.
+
+MAGIC = b"HSR1"
+HEADER = struct.Struct(">4sHHHQI")
+RECORD_PREFIX = struct.Struct(">QBI")
+PROOF_PREFIX = struct.Struct(">Q")
+COUNT = struct.Struct(">I")
+
+
+def pack_record(
+    idx: int,
+    phase: Phase,
+    contributions: int,
+    accval: Optional[bytes],
+    y: Optional[bytes],
+    acc_size: int,
+    y_size: int,
+) -> bytes:
+    accval = accval or bytes(acc_size)
+    y = y or bytes(y_size)
+    if len(accval) != acc_size or len(y) != y_size:
+        raise ValueError("stage values don't match the record width")
+    return RECORD_PREFIX.pack(idx, phase.value, contributions) + accval + y
+
+
+def pack_range(
+    start: int,
+    records: list[bytes],
+    proofs: list[tuple[int, bytes]],
+    acc_size: int,
+    y_size: int,
+    proof_size: int,
+) -> bytes:
+    parts = [HEADER.pack(MAGIC, acc_size, y_size, proof_size, start, len(records))]
+    parts.extend(records)
+    parts.append(COUNT.pack(len(proofs)))
+    for idx, proof in proofs:
+        if len(proof) != proof_size:
+            raise ValueError("proof doesn't match the record width")
+        parts.append(PROOF_PREFIX.pack(idx))
+        parts.append(proof)
+    return b"".join(parts)
+
+
+def unpack_range(data: bytes) -> tuple[list[dict], dict[int, bytes]]:
+    """
+    Decode a stage range into stage info dicts (the same shape as /api/stage
+    returns, without proofs) and a mapping from stage index to proof.
+    """
+    view = memoryview(data)
+    magic, acc_size, y_size, proof_size, start, count = HEADER.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError("not a stage range")
+    off = HEADER.size
+    width = RECORD_PREFIX.size + acc_size + y_size
+    stages = []
+    for _ in range(count):
+        idx, phase, contributions = RECORD_PREFIX.unpack_from(view, off)
+        phase = Phase(phase)
+        info = {"stage": idx, "phase": phase, "contributions": contributions}
+        body = off + RECORD_PREFIX.size
+        if phase >= Phase.EVALUATION:
+            info["accval"] = bytes(view[body : body + acc_size])
+        if phase >= Phase.DONE:
+            info["vdfy"] = bytes(view[body + acc_size : body + acc_size + y_size])
+        stages.append(info)
+        off += width
+    (nproofs,) = COUNT.unpack_from(view, off)
+    off += COUNT.size
+    proofs = {}
+    for _ in range(nproofs):
+        (idx,) = PROOF_PREFIX.unpack_from(view, off)
+        off += PROOF_PREFIX.size
+        proofs[idx] = bytes(view[off : off + proof_size])
+        off += proof_size
+    return stages, proofs
@@ -1,2 +1,8 @@
 #!/bin/sh
-gunicorn -k gevent --bind 0.0.0.0:5000 headstart.server:app
+# one beacon process owns the stage chain, the HTTP workers talk to it over a unix socket
+export HEADSTART_BEACON_SOCKET="${HEADSTART_BEACON_SOCKET:-$PWD/beacon.sock}"
+python -m headstart.ipc &
+BEACON_PID=$!
+trap 'kill $BEACON_PID' EXIT INT TERM
+while [ ! -S "$HEADSTART_BEACON_SOCKET" ]; do sleep 0.1; done
+gunicorn -k gevent -w "${WORKERS:-$(nproc)}" --bind 0.0.0.0:5000 headstart.server:app
@@ -1,6 +1,6 @@
 from headstart.acc.rsa_accumulator import RSAAccumulator, RSAPrimeAccumulator
 from headstart.acc.bqf_accumulator import BQFAccumulator, ChiaBQFAccumulator
-from headstart.acc.merkle_tree import MerkleHash, MerkleTreeAccumulator
+from headstart.acc.merkle_tree import MerkleHash, MerkleTree, MerkleTreeAccumulator
 from headstart.abstract import AbstractAccumulator
 from hashlib import sha256
 import os, timeit, random
@@ -69,3 +69,40 @@ Testing <bqf_accumulator.ChiaBQFAccumulator object at 0x7f28ffdbff10> with 2^10
 Testing <bqf_accumulator.BQFAccumulator object at 0x7f28ffdbff90> with 2^10 parties
 44.874894668668276
 """
+
+
+def test_merkle_build(bits: int):
+    data = [os.urandom(16) for _ in range(1 << bits)]
+    start = timeit.default_timer()
+    MerkleTree.from_data(MerkleHash(sha256), data, keep_data=False)
+    return timeit.default_timer() - start
+
+
+for bits in range(16, 23, 2):
+    print(f"Building a Merkle tree with 2^{bits} leaves")
+    print(test_merkle_build(bits))
+
+"""
+Building level by level:
+Building a Merkle tree with 2^16 leaves
+0.04236983200007671
+Building a Merkle tree with 2^18 leaves
+0.16704332400058775
+Building a Merkle tree with 2^20 leaves
+0.6702540599999338
+Building a Merkle tree with 2^22 leaves
+2.733550257999923
+"""
+
+"""
+Hashing each node from a copy of a hasher that already absorbed the prefix,
+without building the node input:
+Building a Merkle tree with 2^16 leaves
+0.036859337000350934
+Building a Merkle tree with 2^18 leaves
+0.15162224399955448
+Building a Merkle tree with 2^20 leaves
+0.6171745040001042
+Building a Merkle tree with 2^22 leaves
+2.4628633239999544
+"""
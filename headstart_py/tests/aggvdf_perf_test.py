@@ -3,14 +3,23 @@ import timeit, os
 
 
 K = 3
+nthreads = os.cpu_count()
 for bits in [1024]:
     for T in range(16, 24):
         vdf = AggregateChiaVDF(bits, 1 << T)
         challenges = [os.urandom(8) for _ in range(10)]
         t_eval = timeit.timeit(lambda: vdf.eval(challenges[:1]), number=K) / K
-        ys = vdf.eval(challenges)
-        t_agg = timeit.timeit(lambda: vdf.aggregate(challenges, ys), number=K) / K
-        print(f"bits={bits}, T={T}, t_eval={t_eval}, t_agg={t_agg}")
+        ys = vdf.eval(challenges, nthreads=nthreads)
+        t_agg = (
+            timeit.timeit(lambda: vdf.aggregate(challenges, ys, nthreads), number=K) / K
+        )
+        t_fused = (
+            timeit.timeit(
+                lambda: vdf.eval_and_aggregate(challenges, nthreads=nthreads), number=K
+            )
+            / K
+        )
+        print(f"bits={bits}, T={T}, t_eval={t_eval}, t_agg={t_agg}, t_fused={t_fused}")
 
 """
 bits=1024, T=16, t_eval=0.15650326833322956, t_agg=0.2770001553338564